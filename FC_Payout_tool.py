@@ -1,6 +1,4 @@
 import os
-import contextlib
-import io
 import sys
 from pathlib import Path
 
@@ -35,13 +33,147 @@ except OSError:
     pass
 
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import re
-from dataclasses import dataclass
+import argparse
+import atexit
+import base64
+import csv
+import hashlib
+import itertools
+import json
+import queue
+import sqlite3
+import subprocess
+import statistics
+import time
+import threading
+import zlib
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from typing import Optional
-import pyperclip
-import requests
-from playwright.sync_api import sync_playwright
+from urllib.parse import urlparse
+# requests, pyperclip and playwright are imported where they are first used so
+# the window comes up without paying for them.
+
+TRACE_ENV = 'FC_PAYOUT_TRACE'
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._record(self.name, self.start, time.perf_counter(), self.args, exc_type)
+        return False
+
+
+class SpanTracer:
+    """Times named stages of the import and display paths.
+
+    Disabled unless FC_PAYOUT_TRACE (or --trace) names a file; span() then
+    returns a shared no-op context manager. When enabled, a per-stage summary
+    is printed at exit and the spans are written to the file in Chrome trace
+    format (open it in chrome://tracing or ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._events = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self, path=None):
+        if not self.enabled:
+            atexit.register(self.finish)
+        self.enabled = True
+        self.path = path
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def _record(self, name, start, end, args, exc_type):
+        if exc_type is not None:
+            args = dict(args, error=exc_type.__name__)
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self._events.append((name, start, end, thread.ident, args))
+
+    def summary(self):
+        """Return (name, count, total_ms, max_ms) per stage, slowest total first."""
+        stages = {}
+        with self._lock:
+            events = list(self._events)
+        for name, start, end, _, _ in events:
+            count, total, longest = stages.get(name, (0, 0.0, 0.0))
+            elapsed = (end - start) * 1000
+            stages[name] = (count + 1, total + elapsed, max(longest, elapsed))
+        return sorted(((name, *stats) for name, stats in stages.items()), key=lambda row: -row[2])
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        trace = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in thread_names.items()
+        ]
+        for name, start, end, tid, args in events:
+            trace.append({
+                'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': round((start - self._origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                'args': args,
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def finish(self):
+        """Print the session summary and write the trace file."""
+        if not self.enabled or not self._events:
+            return
+        # stderr keeps the summary out of mail text piped from --cli
+        print(f"{'stage':<28}{'count':>7}{'total ms':>12}{'max ms':>12}", file=sys.stderr)
+        for name, count, total, longest in self.summary():
+            print(f"{name:<28}{count:>7}{total:>12.1f}{longest:>12.1f}", file=sys.stderr)
+        if self.path:
+            try:
+                Path(self.path).write_text(json.dumps(self.chrome_trace()), encoding='utf-8')
+                print(f"Trace written to {self.path}", file=sys.stderr)
+            except OSError as e:
+                print(f"Could not write trace to {self.path}: {e}", file=sys.stderr)
+
+
+tracer = SpanTracer()
+if os.environ.get(TRACE_ENV):
+    tracer.enable(os.environ[TRACE_ENV])
 
 
 def _chromium_relative_path() -> Path:
@@ -63,104 +195,38 @@ def _chromium_installed() -> bool:
     return False
 
 
-def ensure_playwright_ready(root: tk.Tk) -> None:
-    if _chromium_installed():
-        print("Playwright browser already installed; continuing.")
-        return
-
-    print("Playwright browser not found; starting download...")
-    dialog = tk.Toplevel(root)
-    dialog.title("Preparing Playwright")
-    dialog.geometry("460x280")
-    dialog.transient(root)
-    dialog.grab_set()
-    dialog.resizable(False, False)
-    dialog.protocol("WM_DELETE_WINDOW", lambda: None)
-
-    header = tk.Label(dialog, text="Downloading Playwright Chromium...", font=("Segoe UI", 12, "bold"))
-    header.pack(pady=(12, 6))
-
-    log_box = tk.Text(dialog, width=60, height=10, state=tk.DISABLED)
-    log_box.pack(padx=12, pady=(0, 8), fill=tk.BOTH, expand=True)
-
-    status_var = tk.StringVar(value="Downloading browser...")
-    status_label = tk.Label(dialog, textvariable=status_var, font=("Segoe UI", 10, "italic"))
-    status_label.pack(pady=(0, 6))
-
-    continue_button = tk.Button(dialog, text="Continue", state=tk.DISABLED, command=dialog.destroy, width=12)
-    continue_button.pack(pady=(0, 12))
-
-    def append_line(line: str) -> None:
-        print(line.rstrip())
-        log_box.config(state=tk.NORMAL)
-        log_box.insert(tk.END, line)
-        log_box.see(tk.END)
-        log_box.config(state=tk.DISABLED)
-
-    try:
-        append_line("Running: playwright install chromium\n")
-        _install_playwright_browser(on_output=append_line)
-    except Exception as exc:
-        status_var.set(f"Installation failed: {exc}")
-        append_line(str(exc) + "\n")
-        continue_button.config(state=tk.NORMAL)
-    else:
-        if _chromium_installed():
-            status_var.set("Playwright browser installed successfully.")
-            append_line("Playwright Chromium ready.\n")
-            continue_button.config(state=tk.NORMAL)
-            dialog.after(500, dialog.destroy)
-        else:
-            status_var.set("Playwright installed, but Chromium not detected. Please try again.")
-            continue_button.config(state=tk.NORMAL)
-
-    root.wait_window(dialog)
-
-
-
 def _install_playwright_browser(on_output=None):
+    # Runs in a child process so the installer's output is captured without
+    # swapping sys.stdout/sys.stderr under the GUI and worker threads.
     env = os.environ.copy()
     browsers_path = env.get('PLAYWRIGHT_BROWSERS_PATH')
     if browsers_path:
         os.makedirs(browsers_path, exist_ok=True)
-        os.environ['PLAYWRIGHT_BROWSERS_PATH'] = browsers_path
-    emitter = _StreamEmitter(on_output)
-    with contextlib.redirect_stdout(emitter), contextlib.redirect_stderr(emitter):
-        try:
-            _run_playwright_install_cli()
-        except SystemExit as exit_exc:
-            if exit_exc.code not in (None, 0):
-                output = emitter.getvalue().strip()
-                raise RuntimeError(output or f"Playwright exited with code {exit_exc.code}")
-        except Exception as exc:
-            output = emitter.getvalue().strip()
-            details = f"{exc}\n{output}" if output else str(exc)
-            raise RuntimeError(details)
-        finally:
-            emitter.flush()
-
-
-class _StreamEmitter(io.StringIO):
-    def __init__(self, callback):
-        super().__init__()
-        self._callback = callback
-        self._buffer = ''
-
-    def write(self, s):
-        super().write(s)
-        if not self._callback:
-            return len(s)
-        self._buffer += s
-        while '\n' in self._buffer:
-            line, self._buffer = self._buffer.split('\n', 1)
-            self._callback(line + '\n')
-        return len(s)
-
-    def flush(self):
-        if self._callback and self._buffer:
-            self._callback(self._buffer)
-            self._buffer = ''
-        return super().flush()
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable, '--playwright-install']
+    else:
+        command = [sys.executable, '-m', 'playwright', 'install', 'chromium']
+    output = []
+    try:
+        process = subprocess.Popen(
+            command,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            errors='replace',
+        )
+    except OSError as exc:
+        raise RuntimeError(str(exc))
+    with process:
+        for line in process.stdout:
+            output.append(line)
+            if on_output:
+                on_output(line)
+    if process.returncode != 0:
+        details = ''.join(output).strip()
+        raise RuntimeError(details or f"Playwright exited with code {process.returncode}")
 
 
 def _launch_chromium_with_retry(playwright):
@@ -176,6 +242,8 @@ def _launch_chromium_with_retry(playwright):
             return playwright.chromium.launch(headless=True)
         raise
 
+APP_DATA_DIR = Path(os.path.expanduser('~')) / '.fc-payout-tool'
+
 # List of NPCs that can show up on killmails (May not include everyone)
 # Got this list from https://zkillboard.com/corporation/1000274/top/
 IGNORED_CHAR_NAMES = [   	
@@ -196,6 +264,100 @@ IGNORED_CHAR_NAMES = [
     "Tyrannos Polemos",
     "Hikanta Tyrannos"
 ]
+# The corporation those NPCs fly for, which also catches any the list above misses
+NPC_CORPORATION_IDS = ["1000274"]
+PILOT_FILTER_FILE = APP_DATA_DIR / 'pilot_filters.json'
+
+
+class PilotFilter:
+    """Pilots to leave out of imports, by exact name, name pattern, corporation id or alliance id.
+
+    Names are matched case-insensitively against a set, and all patterns are
+    compiled into one regex, so checking a pilot costs the same however many
+    rules there are.
+    """
+
+    def __init__(self, names=(), name_patterns=(), corporation_ids=(), alliance_ids=(),
+                 friendly_corporation_ids=(), friendly_alliance_ids=()):
+        self.names = frozenset(name.strip().casefold() for name in names)
+        self.name_patterns = tuple(name_patterns)
+        self.corporation_ids = frozenset(str(corp_id) for corp_id in corporation_ids)
+        self.alliance_ids = frozenset(str(ally_id) for ally_id in alliance_ids)
+        self.friendly_corporation_ids = frozenset(str(corp_id) for corp_id in friendly_corporation_ids)
+        self.friendly_alliance_ids = frozenset(str(ally_id) for ally_id in friendly_alliance_ids)
+        self._pattern = None
+        if self.name_patterns:
+            self._pattern = re.compile('|'.join(f"(?:{pattern})" for pattern in self.name_patterns), re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path, base=None):
+        """Load rules from a JSON file with optional names, name_patterns, corporation_ids,
+        alliance_ids, friendly_corporation_ids and friendly_alliance_ids lists. Rules from
+        base, if given, are kept as well."""
+        rules = json.loads(Path(path).read_text(encoding='utf-8'))
+        if not isinstance(rules, dict):
+            raise ValueError(f"{path} must hold a JSON object of rule lists")
+        for key, value in rules.items():
+            if key not in PILOT_FILTER_RULES:
+                continue
+            kinds = (str,) if key in ('names', 'name_patterns') else (str, int)
+            if not isinstance(value, list) or any(isinstance(item, bool) or not isinstance(item, kinds) for item in value):
+                expected = "strings" if kinds == (str,) else "ids"
+                raise ValueError(f"{key} in {path} must be a list of {expected}")
+        base = base or cls()
+        try:
+            return cls(**{key: [*getattr(base, key), *rules.get(key, [])] for key in PILOT_FILTER_RULES})
+        except re.error as e:
+            raise ValueError(f"Bad name pattern in {path}: {e}") from None
+
+    def excludes_name(self, name):
+        return name.strip().casefold() in self.names or (self._pattern is not None and self._pattern.search(name) is not None)
+
+    def excludes(self, name, corporation_id=None, alliance_id=None):
+        return (
+            (corporation_id is not None and str(corporation_id) in self.corporation_ids)
+            or (alliance_id is not None and str(alliance_id) in self.alliance_ids)
+            or self.excludes_name(name)
+        )
+
+    @property
+    def has_friendly_rules(self):
+        return bool(self.friendly_corporation_ids or self.friendly_alliance_ids)
+
+    @property
+    def has_affiliation_rules(self):
+        return bool(self.corporation_ids or self.alliance_ids or self.has_friendly_rules)
+
+    def is_friendly(self, corporation_id=None, alliance_id=None):
+        """True when no friendly corporations or alliances are configured, or the pilot is in one."""
+        if not self.has_friendly_rules:
+            return True
+        return (
+            (corporation_id is not None and str(corporation_id) in self.friendly_corporation_ids)
+            or (alliance_id is not None and str(alliance_id) in self.friendly_alliance_ids)
+        )
+
+
+# Rule lists a pilot filter file may hold; each is also a PilotFilter argument and attribute
+PILOT_FILTER_RULES = ('names', 'name_patterns', 'corporation_ids', 'alliance_ids',
+                      'friendly_corporation_ids', 'friendly_alliance_ids')
+
+_default_pilot_filter = None
+
+
+def default_pilot_filter():
+    """The built-in NPC rules plus any in PILOT_FILTER_FILE, loaded on first use."""
+    global _default_pilot_filter
+    if _default_pilot_filter is None:
+        pilot_filter = PilotFilter(names=IGNORED_CHAR_NAMES, corporation_ids=NPC_CORPORATION_IDS)
+        if PILOT_FILTER_FILE.exists():
+            try:
+                pilot_filter = PilotFilter.from_file(PILOT_FILTER_FILE, base=pilot_filter)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring {PILOT_FILTER_FILE}: {e}")
+        _default_pilot_filter = pilot_filter
+    return _default_pilot_filter
+
 
 @dataclass
 class Participant:
@@ -203,8 +365,2086 @@ class Participant:
     included: bool = True
     scout: bool = False
     character_id: Optional[str] = None
-    share: float = 0.0
+    share: Decimal = Decimal(0)
     num_shares: int = 1
+    # Extra payout pool this pilot belongs to (see PayoutRules); None means the line pool
+    tier: Optional[str] = None
+    # Number of imported BRs the pilot appeared in
+    fights: int = 0
+    # Filled in by the ESI affiliation lookup
+    corporation_id: Optional[str] = None
+    alliance_id: Optional[str] = None
+    # Tree key, assigned by ParticipantStore.add and never reused
+    iid: Optional[str] = field(default=None, repr=False, compare=False)
+
+
+class ParticipantStore:
+    """Participants indexed by normalized name, tree iid and character id.
+
+    Iteration follows insertion order; sorted() returns the display order
+    (case-insensitive by name) and is cached until the membership changes.
+    Tree iids come from one counter shared by every store, unlike id(), so
+    a key kept from a cleared fleet can never name a newly added pilot.
+    """
+
+    _next_iid = itertools.count(1)
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_iid = {}
+        self._by_character_id = {}
+        self._sorted = None
+
+    @staticmethod
+    def normalize_name(name):
+        # EVE character names are unique regardless of case
+        return name.strip().casefold()
+
+    @staticmethod
+    def iid(participant):
+        return participant.iid
+
+    def __iter__(self):
+        return iter(list(self._by_name.values()))
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def add(self, participant):
+        """Add a participant or merge it into the existing entry for the same pilot.
+
+        Returns (participant, added) where participant is the stored entry.
+        """
+        existing = self._by_name.get(self.normalize_name(participant.name))
+        if existing is None and participant.character_id is not None:
+            existing = self._by_character_id.get(str(participant.character_id))
+        if existing is not None:
+            if existing.character_id is None and participant.character_id is not None:
+                self.set_character_id(existing, participant.character_id)
+            return existing, False
+
+        participant.iid = f"p{next(self._next_iid)}"
+        self._by_name[self.normalize_name(participant.name)] = participant
+        self._by_iid[participant.iid] = participant
+        if participant.character_id is not None:
+            self._by_character_id[str(participant.character_id)] = participant
+        self._sorted = None
+        return participant, True
+
+    def set_character_id(self, participant, character_id):
+        if participant.character_id is not None:
+            self._by_character_id.pop(str(participant.character_id), None)
+        participant.character_id = character_id
+        if character_id is not None:
+            self._by_character_id[str(character_id)] = participant
+
+    def get_by_name(self, name):
+        return self._by_name.get(self.normalize_name(name))
+
+    def get_by_iid(self, iid):
+        return self._by_iid.get(iid)
+
+    def get_by_character_id(self, character_id):
+        return self._by_character_id.get(str(character_id))
+
+    def remove_iids(self, iids):
+        for iid in iids:
+            participant = self._by_iid.pop(iid, None)
+            if participant is None:
+                continue
+            del self._by_name[self.normalize_name(participant.name)]
+            if participant.character_id is not None:
+                self._by_character_id.pop(str(participant.character_id), None)
+            self._sorted = None
+
+    def clear(self):
+        self._by_name.clear()
+        self._by_iid.clear()
+        self._by_character_id.clear()
+        self._sorted = None
+
+    def sorted(self):
+        if self._sorted is None:
+            self._sorted = sorted(self._by_name.values(), key=lambda p: p.name.lower())
+        return self._sorted
+
+
+EDITABLE_PARTICIPANT_FIELDS = ('included', 'scout', 'num_shares', 'tier')
+
+
+def apply_participant_edits(edits):
+    """Apply (participant, attribute, value) edits as one batch.
+
+    Every edit is validated before any is applied, so a bad value leaves all
+    participants untouched. Returns the number of edits that changed something.
+    """
+    checked = []
+    for participant, attribute, value in edits:
+        if attribute not in EDITABLE_PARTICIPANT_FIELDS:
+            raise ValueError(f"{attribute} cannot be edited")
+        if attribute == 'num_shares':
+            value = int(value)
+            if value < 0:
+                raise ValueError("Share count cannot be negative")
+        elif attribute in ('included', 'scout'):
+            value = bool(value)
+        checked.append((participant, attribute, value))
+
+    changed = 0
+    for participant, attribute, value in checked:
+        if getattr(participant, attribute) != value:
+            setattr(participant, attribute, value)
+            changed += 1
+    return changed
+
+
+def parse_isk(raw):
+    """Parse a user-entered ISK amount such as '1,234,567.89'. Raises ValueError."""
+    cleaned = re.sub(r"[^\d.]", "", raw)
+    try:
+        return Decimal(cleaned).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"No ISK amount in {raw!r}") from None
+
+
+_PASTE_CHAR_ID_RE = re.compile(r"charID[-: ]?(\d+)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _iter_lines(text):
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_pilot_paste(lines, pilot_filter=None):
+    """Yield (name, character_id) for each pilot in a paste; character_id is None when unknown.
+
+    lines is the pasted text or any iterable of lines, such as an open file.
+    Every line is classified on its own, so fleet window rows (tab separated),
+    comma separated names, BR charID- blocks and one name per line can be mixed.
+    The line after a charID- marker is that pilot's name; the lines after it,
+    up to the next marker or a blank line, are its details and are skipped.
+    """
+    pilot_filter = pilot_filter or default_pilot_filter()
+    if isinstance(lines, str):
+        lines = _iter_lines(lines)
+
+    pending_id = None
+    in_block = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            in_block = False
+            continue
+        marker = _PASTE_CHAR_ID_RE.search(line)
+        if marker:
+            pending_id = marker.group(1)
+            in_block = True
+            continue
+
+        char_id = None
+        if pending_id is not None:
+            names = (line,)
+            char_id, pending_id = pending_id, None
+        elif in_block:
+            continue
+        elif "\t" in line:
+            names = (line.split("\t", 1)[0],)
+        elif "," in line:
+            names = line.split(",")
+        else:
+            names = (line,)
+
+        for name in names:
+            name = _WHITESPACE_RE.sub(" ", name.strip())
+            if name and not pilot_filter.excludes_name(name):
+                yield name, char_id
+
+
+def parse_pilot_paste(raw, pilot_filter=None):
+    """Parse pasted pilot data into a list of (name, character_id) pairs."""
+    return list(iter_pilot_paste(raw, pilot_filter))
+
+
+@dataclass(frozen=True)
+class PayoutRules:
+    """How the buyback is split into pools before each pool is shared out.
+
+    pools maps a role to its percentage of the buyback; everything left over
+    goes to remainder_role. A pool with nobody in it hands its percentage to
+    the remainder pool, so the whole buyback is always paid out; with nobody in
+    the remainder pool the filled pools split it all by their percentages, or
+    evenly if those are all 0%.
+    Raises ValueError unless every percentage is a whole number from 0 to 100
+    and together they add up to at most 100.
+    """
+    pools: tuple = (('scout', 50),)
+    remainder_role: str = 'line'
+
+    def __post_init__(self):
+        for role, percent in self.pools:
+            if isinstance(percent, bool) or not isinstance(percent, int):
+                raise ValueError(f"{role} percentage must be a whole number, not {percent!r}")
+            if not 0 <= percent <= 100:
+                raise ValueError(f"{role} percentage must be between 0 and 100, not {percent}")
+        total = sum(percent for _role, percent in self.pools)
+        if total > 100:
+            raise ValueError(f"pool percentages add up to {total}%, more than the whole buyback")
+
+    @property
+    def roles(self):
+        return [role for role, _percent in self.pools] + [self.remainder_role]
+
+    def percent_for(self, role):
+        return dict(self.pools).get(role)
+
+
+DEFAULT_PAYOUT_RULES = PayoutRules()
+
+
+def isk_to_cents(isk):
+    return int((Decimal(str(isk)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def cents_to_isk(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def _largest_remainder(total, weights):
+    """Split integer total in proportion to weights so the parts sum exactly to total."""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        return [0] * len(weights)
+    parts = [total * weight // weight_sum for weight in weights]
+    short = total - sum(parts)
+    # Hand the leftover units to the largest fractional remainders, earliest row first on ties
+    by_remainder = sorted(range(len(weights)), key=lambda i: -(total * weights[i] % weight_sum))
+    for i in by_remainder[:short]:
+        parts[i] += 1
+    return parts
+
+
+class ShareTable:
+    """Compact column store of the inputs the payout depends on: included, role and share weight."""
+
+    def __init__(self, rules=DEFAULT_PAYOUT_RULES):
+        self.rules = rules
+        self._role_index = {role: index for index, role in enumerate(rules.roles)}
+        self.included = array('B')
+        self.role = array('B')
+        self.weight = array('q')
+
+    @classmethod
+    def from_participants(cls, participants, dynamic, rules=DEFAULT_PAYOUT_RULES):
+        table = cls(rules)
+        for p in participants:
+            table.append(p.included, 'scout' if p.scout else (p.tier or rules.remainder_role),
+                         p.num_shares if dynamic else 1)
+        return table
+
+    def append(self, included, role, weight):
+        self.included.append(1 if included else 0)
+        self.role.append(self._role_index.get(role, self._role_index[self.rules.remainder_role]))
+        self.weight.append(max(int(weight), 0))
+
+    def __len__(self):
+        return len(self.included)
+
+    def allocate(self, buyback_cents):
+        """Return an array of payouts in cents, one per row, summing exactly to buyback_cents when anyone is paid."""
+        roles = self.rules.roles
+        remainder_index = len(roles) - 1
+        members = [[] for _ in roles]
+        for row in range(len(self)):
+            if self.included[row] and self.weight[row]:
+                members[self.role[row]].append(row)
+
+        percents = [self.rules.percent_for(role) or 0 for role in roles[:-1]]
+        active = [i for i in range(remainder_index) if members[i]]
+        pool_cents = [0] * len(roles)
+        if members[remainder_index]:
+            for i in active:
+                pool_cents[i] = buyback_cents * percents[i] // 100
+            pool_cents[remainder_index] = buyback_cents - sum(pool_cents)
+        elif active:
+            # Nobody in the remainder pool: the filled pools split everything by their
+            # percentages, or evenly when those are all 0%, so the buyback is still paid out
+            weights = [percents[i] for i in active]
+            if not any(weights):
+                weights = [1] * len(active)
+            for i, cents in zip(active, _largest_remainder(buyback_cents, weights)):
+                pool_cents[i] = cents
+
+        payouts = array('q', bytes(8 * len(self)))
+        for pool, rows in enumerate(members):
+            if not rows:
+                continue
+            for row, cents in zip(rows, _largest_remainder(pool_cents[pool], [self.weight[row] for row in rows])):
+                payouts[row] = cents
+        return payouts
+
+
+def calculate_shares(participants, buyback_isk, dynamic, rules=DEFAULT_PAYOUT_RULES):
+    """Split buyback_isk across participants, setting each participant's share in exact ISK."""
+    participants = list(participants)
+    payouts = ShareTable.from_participants(participants, dynamic, rules).allocate(isk_to_cents(buyback_isk))
+    for participant, cents in zip(participants, payouts):
+        participant.share = cents_to_isk(cents)
+
+
+# In-game mail limits the payout has to fit in
+MAIL_MAX_RECIPIENTS = 50
+MAIL_MAX_CHARS = 8000
+
+
+def _mail_recipient(participant):
+    if participant.character_id:
+        return f"<url=showinfo:1383//{participant.character_id}>{participant.name}</url>"
+    return participant.name
+
+
+def _mail_role(participant, rules):
+    """The pool a participant is paid from, matching ShareTable.from_participants."""
+    role = 'scout' if participant.scout else (participant.tier or rules.remainder_role)
+    return role if role in rules.roles else rules.remainder_role
+
+
+def _payout_mail_rows(participants, buyback_isk, dynamic, rules=DEFAULT_PAYOUT_RULES):
+    """Return {role: [(participant, body line)]} for every included pilot, in pool order.
+
+    Share counts are shown against the pilot's own pool, since each pool is shared out separately.
+    """
+    members = {role: [] for role in ['scout', *rules.roles]}
+    for p in participants:
+        if p.included:
+            members[_mail_role(p, rules)].append(p)
+
+    sections = {}
+    for role, pilots in members.items():
+        pool_shares = sum(p.num_shares for p in pilots)
+        rows = []
+        for p in pilots:
+            if role == 'scout' and len(pilots) == 1:
+                scout_percent = p.share * 100 / buyback_isk if buyback_isk else 0
+                row = f"- {_mail_recipient(p)} ({scout_percent:.0f}% = {p.share:,.2f} ISK)"
+            elif dynamic:
+                row = f"- {_mail_recipient(p)}: {p.share:,.2f} ISK   {p.num_shares}/{pool_shares} shares"
+            else:
+                row = f"- {_mail_recipient(p)}: {p.share:,.2f} ISK"
+            rows.append((p, row))
+        sections[role] = rows
+    return sections
+
+
+def _render_payout_mail(recipients, sections, buyback_isk, rules=DEFAULT_PAYOUT_RULES, part=None):
+    """sections maps a role to its body lines. The scout and remainder sections are always
+    shown; other pools only when they have someone in them."""
+    included_summary = ", ".join(recipients)
+    scout_member_lines = "".join(f"{row}\n" for row in sections.get('scout', [])) or "\n"
+    tier_sections = "".join(
+        f"{role.capitalize()} Members:\n" + "".join(f"{row}\n" for row in sections[role]) + "\n"
+        for role in rules.roles[:-1] if role != 'scout' and sections.get(role)
+    )
+    line_member_lines = "".join(f"{row}\n" for row in sections.get(rules.remainder_role, []))
+    part_line = f"Payout mail {part[0]} of {part[1]}\n\n" if part else ""
+
+    return f"""
+SEND TO:
+{included_summary if included_summary else 'None'}
+
+Hey everyone,
+
+Thanks for joining the op! Here's the payout for the recent loot buyback.
+
+Buyback Total: {buyback_isk:,.2f} ISK
+
+{part_line}Scout(s):
+{scout_member_lines if scout_member_lines else 'None'}
+{tier_sections}{rules.remainder_role.capitalize()} Members:
+{line_member_lines if line_member_lines else 'None'}
+"""
+
+
+def format_payout_mail(participants, buyback_isk, dynamic, rules=DEFAULT_PAYOUT_RULES):
+    """Build the in-game payout mail text."""
+    sections = _payout_mail_rows(participants, buyback_isk, dynamic, rules)
+    return _render_payout_mail(
+        [_mail_recipient(p) for p in participants if p.included],
+        {role: [row for _, row in rows] for role, rows in sections.items()}, buyback_isk, rules,
+    )
+
+
+def build_payout_mails(participants, buyback_isk, dynamic, max_recipients=MAIL_MAX_RECIPIENTS, max_chars=MAIL_MAX_CHARS,
+                       rules=DEFAULT_PAYOUT_RULES):
+    """Split the payout mail into a numbered series that fits the in-game limits.
+
+    Each mail goes to at most max_recipients pilots, lists only their
+    payouts and stays under max_chars. A payout that fits in one mail is
+    returned as the single format_payout_mail text.
+    """
+    sections = _payout_mail_rows(participants, buyback_isk, dynamic, rules)
+    rows = [(role, p, row) for role, role_rows in sections.items() for p, row in role_rows]
+    single = format_payout_mail(participants, buyback_isk, dynamic, rules)
+    if len(rows) <= max_recipients and len(single) <= max_chars:
+        return [single]
+
+    # Text every mail carries, with room for the widest part number and every pool heading
+    overhead = len(_render_payout_mail([], {}, buyback_isk, rules, part=(999, 999)))
+    overhead += sum(len(f"{role.capitalize()} Members:\n\n") for role in rules.roles[:-1] if role != 'scout')
+    batches = []
+    batch = []
+    size = overhead
+    for role, p, row in rows:
+        cost = len(_mail_recipient(p)) + 2 + len(row) + 1
+        if batch and (len(batch) >= max_recipients or size + cost > max_chars):
+            batches.append(batch)
+            batch = []
+            size = overhead
+        batch.append((role, p, row))
+        size += cost
+    if batch:
+        batches.append(batch)
+
+    mails = []
+    for number, batch in enumerate(batches, 1):
+        batch_sections = {}
+        for role, _p, row in batch:
+            batch_sections.setdefault(role, []).append(row)
+        mails.append(_render_payout_mail(
+            [_mail_recipient(p) for _, p, _ in batch], batch_sections, buyback_isk, rules, part=(number, len(batches)),
+        ))
+    return mails
+
+
+# One alternation over every token of interest so a BR page is scanned exactly once.
+# A link token spans its whole <a ...> tag; like BR_SCAN_SCRIPT, its href says
+# what it links to and allyID-/corpID- markers in its attributes still count.
+# Markers anywhere else match the bare marker tokens.
+_BR_TOKEN_RE = re.compile(
+    r'<h4[^>]*>Team (?P<team>[A-Z])[^<]*</h4>'
+    r'|<a\b(?P<link_attrs>[^>]*)>(?P<link_text>[^<]*)'
+    r'|allyID-(?P<ally_id>\d+)'
+    r'|corpID-(?P<corp_id>\d+)'
+)
+_BR_LINK_RE = re.compile(r'\bhref="[^"]*?/(character|alliance|corporation)/(\d+)/')
+_BR_MARKER_RE = re.compile(r'(allyID|corpID)-(\d+)')
+
+
+@dataclass
+class BRTeam:
+    letter: str
+    alliances: set = field(default_factory=set)
+    corporations: set = field(default_factory=set)
+    characters: list = field(default_factory=list)
+
+
+@dataclass
+class BattleReport:
+    teams: dict = field(default_factory=dict)
+    alliance_names: dict = field(default_factory=dict)
+    corporation_names: dict = field(default_factory=dict)
+
+    def team_data(self):
+        """Return the team list in the shape used by show_team_selection_dialog."""
+        team_data = []
+        for letter in sorted(self.teams):
+            team = self.teams[letter]
+            affil_names = {self.alliance_names[a] for a in team.alliances if a in self.alliance_names}
+            affil_names.update(self.corporation_names[c] for c in team.corporations if c in self.corporation_names)
+            affil_names = sorted(affil_names)
+            team_data.append({
+                'name': f"Team {letter}",
+                'alliances': ', '.join(affil_names) if affil_names else 'Unknown',
+                'characters': team.characters,
+            })
+        return team_data
+
+
+def build_br_report(scan, pilot_filter=None):
+    """Build a BattleReport from raw BR scan data.
+
+    scan holds 'pilots' ([char_id, name, ally_id, corp_id] in page order),
+    'allyTeam'/'corpTeam' (affiliation id -> team letter) and
+    'allyNames'/'corpNames' (affiliation id -> name).
+    """
+    pilot_filter = pilot_filter or default_pilot_filter()
+    alliance_to_team = scan['allyTeam']
+    corp_to_team = scan['corpTeam']
+    report = BattleReport(alliance_names=dict(scan['allyNames']), corporation_names=dict(scan['corpNames']))
+
+    seen = set()
+    for char_id, char_name, ally_id, corp_id in scan['pilots']:
+        if pilot_filter.excludes(char_name, corp_id, ally_id):
+            continue
+        team_letter = alliance_to_team.get(ally_id) if ally_id else None
+        if not team_letter and corp_id:
+            team_letter = corp_to_team.get(corp_id)
+        if not team_letter or (team_letter, char_id) in seen:
+            continue
+        seen.add((team_letter, char_id))
+
+        team = report.teams.get(team_letter)
+        if team is None:
+            team = report.teams[team_letter] = BRTeam(team_letter)
+        team.characters.append({'id': char_id, 'name': char_name})
+        if ally_id:
+            team.alliances.add(ally_id)
+        if corp_id:
+            team.corporations.add(corp_id)
+
+    return report
+
+
+def scan_br_html(html):
+    """Collect the raw BR scan data from page HTML in a single tokenizer pass."""
+    scan = {'pilots': [], 'allyTeam': {}, 'corpTeam': {}, 'allyNames': {}, 'corpNames': {}}
+    current_team = None
+    # Every pilot link is followed by its own allyID-/corpID- markers, so the
+    # open record collects affiliations until the next pilot link starts.
+    open_pilot = None
+
+    def note_marker(kind, affiliation_id):
+        is_ally = kind == 'allyID'
+        if current_team:
+            (scan['allyTeam'] if is_ally else scan['corpTeam']).setdefault(affiliation_id, current_team)
+        slot = 2 if is_ally else 3
+        if open_pilot and open_pilot[slot] is None:
+            open_pilot[slot] = affiliation_id
+
+    for match in _BR_TOKEN_RE.finditer(html):
+        kind = match.lastgroup
+        if kind == 'team':
+            current_team = match.group('team')
+            open_pilot = None
+        elif kind == 'ally_id':
+            note_marker('allyID', match.group('ally_id'))
+        elif kind == 'corp_id':
+            note_marker('corpID', match.group('corp_id'))
+        else:
+            attrs = match.group('link_attrs')
+            target = _BR_LINK_RE.search(attrs)
+            text = match.group('link_text').strip()
+            if target and text:
+                link_kind, link_id = target.groups()
+                if link_kind == 'character':
+                    open_pilot = [link_id, text, None, None]
+                    scan['pilots'].append(open_pilot)
+                elif link_kind == 'alliance':
+                    scan['allyNames'].setdefault(link_id, text)
+                else:
+                    scan['corpNames'].setdefault(link_id, text)
+            if 'ID-' in attrs:
+                for marker in _BR_MARKER_RE.finditer(attrs):
+                    note_marker(marker.group(1), marker.group(2))
+
+    return scan
+
+
+def parse_br_html(html, pilot_filter=None):
+    """Parse a rendered br.evetools.org page into a BattleReport in a single pass."""
+    return build_br_report(scan_br_html(html), pilot_filter)
+
+
+def merge_br_attendance(teams):
+    """Union the chosen BRTeam of several BRs by character id.
+
+    Returns (character_id, name, fights) in first-seen order, where fights is
+    the number of the given teams the pilot appears in.
+    """
+    attendance = {}
+    for team in teams:
+        for char in team.characters:
+            entry = attendance.get(char['id'])
+            if entry is None:
+                attendance[char['id']] = [char['name'], 1]
+            else:
+                entry[1] += 1
+    return [(char_id, name, fights) for char_id, (name, fights) in attendance.items()]
+
+
+# In-page counterpart of scan_br_html: walks the live DOM once and returns the
+# same compact scan structure, so only ids and names cross the Playwright pipe.
+BR_SCAN_SCRIPT = r"""
+() => {
+    const marker = /(allyID|corpID)-(\d+)/g;
+    const link = /\/(character|alliance|corporation)\/(\d+)\//;
+    const scan = {pilots: [], allyTeam: {}, corpTeam: {}, allyNames: {}, corpNames: {}};
+    let team = null;
+    let pilot = null;
+    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT);
+    for (let el = walker.currentNode; el; el = walker.nextNode()) {
+        if (el.tagName === 'H4') {
+            const header = /^Team ([A-Z])/.exec(el.textContent.trim());
+            if (header) {
+                team = header[1];
+                pilot = null;
+                continue;
+            }
+        }
+        if (el.tagName === 'A') {
+            const target = link.exec(el.getAttribute('href') || '');
+            const text = el.textContent.trim();
+            if (target && text) {
+                if (target[1] === 'character') {
+                    pilot = [target[2], text, null, null];
+                    scan.pilots.push(pilot);
+                } else if (target[1] === 'alliance') {
+                    if (!(target[2] in scan.allyNames)) scan.allyNames[target[2]] = text;
+                } else if (!(target[2] in scan.corpNames)) {
+                    scan.corpNames[target[2]] = text;
+                }
+            }
+        }
+        for (const attr of el.attributes) {
+            for (const found of attr.value.matchAll(marker)) {
+                const isAlly = found[1] === 'allyID';
+                const teams = isAlly ? scan.allyTeam : scan.corpTeam;
+                if (team && !(found[2] in teams)) teams[found[2]] = team;
+                const slot = isAlly ? 2 : 3;
+                if (pilot && pilot[slot] === null) pilot[slot] = found[2];
+            }
+        }
+    }
+    return scan;
+}
+"""
+
+
+BR_API_BASE = "https://br.evetools.org/api/v1"
+ESI_BASE = "https://esi.evetech.net/latest"
+# /universe/names/ accepts at most 1000 ids per request
+ESI_NAMES_CHUNK = 1000
+
+
+def _br_api_url(url, api_base=BR_API_BASE):
+    """Map a br.evetools.org page URL to the JSON endpoint the page itself loads."""
+    path = urlparse(url).path.strip('/')
+    match = re.fullmatch(r'br/([0-9a-fA-F]+)', path)
+    if match:
+        return f"{api_base}/composition/get/{match.group(1)}"
+    match = re.fullmatch(r'related/(\d+)/(\d+)', path)
+    if match:
+        return f"{api_base}/related/{match.group(1)}/{match.group(2)}"
+    return None
+
+
+def _br_killmails(payload):
+    if 'kms' in payload:
+        return payload['kms']
+    return [km for related in payload.get('relateds', []) for km in related.get('kms', [])]
+
+
+TRANSPORT_ENV = 'FC_PAYOUT_TRANSPORT'
+LATENCY_ENV = 'FC_PAYOUT_LATENCY'
+TRANSPORT_MODES = ('live', 'record', 'replay')
+
+
+class Transport:
+    """Where outbound I/O goes: live to the network, record (live, saving every
+    exchange to a directory) or replay (answered only from that directory).
+
+    All ESI and BR API requests go through EsiClient.session and all browser
+    loads through a BrowserWorker, so wrapping those two covers everything.
+    latency, in seconds, is added before each request in any mode to simulate
+    a slow ESI. Live with no latency wraps nothing.
+    """
+
+    def __init__(self):
+        self.mode = 'live'
+        self.directory = None
+        self.latency = 0.0
+
+    def configure(self, spec=None, latency_ms=None):
+        """spec is 'live', 'record:DIR' or 'replay:DIR'. Raises ValueError."""
+        if spec:
+            mode, _, directory = spec.partition(':')
+            if mode not in TRANSPORT_MODES:
+                raise ValueError(f"unknown transport {mode!r}; use live, record:DIR or replay:DIR")
+            if mode != 'live' and not directory:
+                raise ValueError(f"{mode} needs a directory, e.g. {mode}:recordings")
+            directory = Path(directory) if directory else None
+            if mode == 'record':
+                directory.mkdir(parents=True, exist_ok=True)
+            elif mode == 'replay' and not directory.is_dir():
+                raise ValueError(f"no recordings in {directory}")
+            self.mode = mode
+            self.directory = directory
+        if latency_ms is not None:
+            try:
+                latency = float(latency_ms)
+            except ValueError:
+                raise ValueError(f"latency must be a number of milliseconds, not {latency_ms!r}") from None
+            if latency < 0:
+                raise ValueError("latency cannot be negative")
+            self.latency = latency / 1000
+
+    @property
+    def isolated(self):
+        """Whether local caches should start empty, so every request reaches the recording."""
+        return self.mode != 'live'
+
+    def wrap_session(self, session):
+        if self.mode == 'live' and not self.latency:
+            return session
+        return _TransportSession(self, session)
+
+    def wrap_browser(self, worker):
+        if self.mode == 'live' and not self.latency:
+            return worker
+        return _TransportBrowser(self, worker)
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        return self.directory / f"{key[0]}-{digest[:32]}.json"
+
+    def load(self, key):
+        try:
+            return json.loads(self._path(key).read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, record):
+        path = self._path(key)
+        # Written aside and swapped in so a concurrent replay never reads half a file
+        temp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        temp.write_text(json.dumps(record, indent=1), encoding='utf-8')
+        os.replace(temp, path)
+
+
+class _TransportSession:
+    """Stands in for a requests.Session, recording or replaying each exchange.
+
+    Requests are keyed on method, URL, query parameters and JSON body; headers
+    are not part of the key, so a replay answers with the last recorded response.
+    """
+
+    def __init__(self, transport, session):
+        self.transport = transport
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        import requests
+
+        key = ('http', method.upper(), url, kwargs.get('params'), kwargs.get('json'))
+        self.transport.delay()
+        if self.transport.mode == 'replay':
+            record = self.transport.load(key)
+            if record is None:
+                raise requests.RequestException(f"No recorded response for {method.upper()} {url}")
+            response = requests.Response()
+            response.status_code = record['status']
+            response.reason = record.get('reason')
+            response.headers = requests.structures.CaseInsensitiveDict(record['headers'])
+            if record['body_encoding'] == 'base64':
+                response._content = base64.b64decode(record['body'])
+            else:
+                response._content = record['body'].encode('utf-8')
+            response.encoding = 'utf-8'
+            response.url = url
+            return response
+
+        response = self.session.request(method, url, **kwargs)
+        if self.transport.mode == 'record':
+            try:
+                body, body_encoding = response.content.decode('utf-8'), 'utf-8'
+            except UnicodeDecodeError:
+                body, body_encoding = base64.b64encode(response.content).decode('ascii'), 'base64'
+            self.transport.save(key, {
+                'method': method.upper(), 'url': url, 'params': kwargs.get('params'), 'json': kwargs.get('json'),
+                'status': response.status_code, 'reason': response.reason, 'headers': dict(response.headers),
+                'body': body, 'body_encoding': body_encoding,
+            })
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class _TransportBrowser:
+    """Stands in for a BrowserWorker, recording or replaying each loaded BR page."""
+
+    def __init__(self, transport, worker):
+        self.transport = transport
+        self.worker = worker
+
+    def prepare(self, on_output=None):
+        if self.transport.mode == 'replay':
+            ready = Future()
+            ready.set_result(True)
+            return ready
+        return self.worker.prepare(on_output=on_output)
+
+    def fetch_payloads(self, urls, cancel_event=None, on_progress=None, **kwargs):
+        keys = [('browser', normalize_br_url(url)) for url in urls]
+        self.transport.delay()
+        if self.transport.mode == 'replay':
+            records = [self.transport.load(key) for key in keys]
+            return [
+                record['payload'] if record is not None else RuntimeError(f"No recorded page for {url}")
+                for url, record in zip(urls, records)
+            ]
+        payloads = self.worker.fetch_payloads(urls, cancel_event=cancel_event, on_progress=on_progress, **kwargs)
+        if self.transport.mode == 'record':
+            for key, url, raw in zip(keys, urls, payloads):
+                if not isinstance(raw, Exception):
+                    self.transport.save(key, {'url': url, 'payload': raw})
+        return payloads
+
+    def shutdown(self):
+        self.worker.shutdown()
+
+
+transport = Transport()
+try:
+    transport.configure(os.environ.get(TRANSPORT_ENV), os.environ.get(LATENCY_ENV) or None)
+except (OSError, ValueError) as e:
+    sys.exit(f"{TRANSPORT_ENV}/{LATENCY_ENV}: {e}")
+
+
+# /universe/ids/ rejects requests with more than 500 names
+ESI_IDS_CHUNK = 500
+ESI_MAX_WORKERS = 4
+ESI_MAX_RETRIES = 3
+# Stop sending requests once this few errors remain in ESI's error window
+ESI_ERROR_LIMIT_FLOOR = 10
+
+
+class EsiClient:
+    """Pooled ESI access: one keep-alive session, a bounded worker pool and error-limit backoff."""
+
+    def __init__(self, esi_base=ESI_BASE, session=None, max_workers=ESI_MAX_WORKERS):
+        self.esi_base = esi_base
+        self.max_workers = max_workers
+        self._session = session
+        self._session_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="esi")
+        self._pause_lock = threading.Lock()
+        self._pause_until = 0.0
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = transport.wrap_session(session)
+            return self._session
+
+    def _wait_for_error_window(self):
+        with self._pause_lock:
+            delay = self._pause_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _note_error_limit(self, response):
+        remain = response.headers.get('X-ESI-Error-Limit-Remain')
+        reset = response.headers.get('X-ESI-Error-Limit-Reset')
+        if response.status_code == 420 or (remain is not None and int(remain) < ESI_ERROR_LIMIT_FLOOR):
+            with self._pause_lock:
+                self._pause_until = max(self._pause_until, time.time() + int(reset or 60))
+
+    def request(self, method, path, **kwargs):
+        """Send a request, backing off on 420/5xx and connection errors. Other statuses are returned as-is."""
+        import requests
+
+        kwargs.setdefault('timeout', 30)
+        for attempt in range(ESI_MAX_RETRIES + 1):
+            self._wait_for_error_window()
+            try:
+                with tracer.span('esi.request', method=method, path=path, attempt=attempt):
+                    response = self.session.request(method, f"{self.esi_base}{path}", **kwargs)
+            except requests.ConnectionError:
+                if attempt == ESI_MAX_RETRIES:
+                    raise
+            else:
+                self._note_error_limit(response)
+                if response.status_code != 420 and response.status_code < 500:
+                    return response
+                if attempt == ESI_MAX_RETRIES:
+                    response.raise_for_status()
+            time.sleep(2 ** attempt)
+
+    def map(self, func, items):
+        """Run func over items on the worker pool, preserving order."""
+        return list(self._executor.map(func, items))
+
+    def post_chunks(self, path, items, chunk_size, on_response=None):
+        """POST items in chunks concurrently.
+
+        Returns (payloads, failed) where failed lists the items of chunks that
+        could not be fetched, so one bad chunk does not drop the others.
+        on_response, if given, is called with each successful response as it arrives.
+        """
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+        def post(chunk):
+            try:
+                response = self.request('POST', path, json=chunk)
+                response.raise_for_status()
+                return response, None
+            except Exception as e:
+                print(f"Error querying ESI {path} for {len(chunk)} items: {e}")
+                return None, chunk
+
+        payloads = []
+        failed = []
+        for future in as_completed([self._executor.submit(post, chunk) for chunk in chunks]):
+            response, failed_chunk = future.result()
+            if failed_chunk is not None:
+                failed.extend(failed_chunk)
+                continue
+            payloads.append(response)
+            if on_response:
+                on_response(response)
+        return payloads, failed
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+
+def _resolve_esi_names(ids, esi):
+    responses, failed = esi.post_chunks('/universe/names/', list(ids), ESI_NAMES_CHUNK)
+    if failed:
+        raise RuntimeError(f"Could not resolve {len(failed)} names from ESI")
+    return {str(item['id']): item['name'] for response in responses for item in response.json() or []}
+
+
+def br_payload_to_report(payload, names, pilot_filter=None):
+    """Map a BR JSON payload (teams of affiliation ids plus ESI-style killmails) to a BattleReport."""
+    pilot_filter = pilot_filter or default_pilot_filter()
+    report = BattleReport()
+    affiliation_to_team = {}
+    for idx, members in enumerate(payload.get('teams', [])):
+        letter = chr(ord('A') + idx)
+        for affiliation_id in members:
+            affiliation_to_team.setdefault(str(affiliation_id), letter)
+
+    seen = set()
+    for km in _br_killmails(payload):
+        for pilot in [km.get('victim', {})] + km.get('attackers', []):
+            char_id = pilot.get('character_id')
+            if not char_id:
+                continue
+            char_id = str(char_id)
+            ally_id = str(pilot['alliance_id']) if pilot.get('alliance_id') else None
+            corp_id = str(pilot['corporation_id']) if pilot.get('corporation_id') else None
+            team_letter = affiliation_to_team.get(ally_id) if ally_id else None
+            if not team_letter and corp_id:
+                team_letter = affiliation_to_team.get(corp_id)
+            char_name = names.get(char_id)
+            if not team_letter or not char_name or (team_letter, char_id) in seen:
+                continue
+            if pilot_filter.excludes(char_name, corp_id, ally_id):
+                continue
+            seen.add((team_letter, char_id))
+
+            team = report.teams.get(team_letter)
+            if team is None:
+                team = report.teams[team_letter] = BRTeam(team_letter)
+            team.characters.append({'id': char_id, 'name': char_name})
+            if ally_id:
+                team.alliances.add(ally_id)
+                if ally_id in names:
+                    report.alliance_names[ally_id] = names[ally_id]
+            if corp_id:
+                team.corporations.add(corp_id)
+                if corp_id in names:
+                    report.corporation_names[corp_id] = names[corp_id]
+
+    return report
+
+
+def fetch_br_payload(url, esi=None, api_base=BR_API_BASE):
+    """Fetch a BR's JSON payload, and the names it refers to, without a browser.
+
+    Returns {'kind': 'api', 'payload': ..., 'names': ...} for br_report_from_payload,
+    or None when the URL has no known API endpoint so callers can fall back to Playwright.
+    """
+    api_url = _br_api_url(url, api_base)
+    if api_url is None:
+        return None
+    esi = esi or EsiClient()
+    with tracer.span('br_api.get', url=api_url):
+        response = esi.session.get(api_url, timeout=30)
+        response.raise_for_status()
+        payload = response.json() or {}
+
+    ids = set()
+    for km in _br_killmails(payload):
+        for pilot in [km.get('victim', {})] + km.get('attackers', []):
+            for key in ('character_id', 'corporation_id', 'alliance_id'):
+                if pilot.get(key):
+                    ids.add(int(pilot[key]))
+    with tracer.span('br_api.names', ids=len(ids)):
+        names = _resolve_esi_names(sorted(ids), esi) if ids else {}
+    return {'kind': 'api', 'payload': payload, 'names': names}
+
+
+def fetch_br_report(url, esi=None, api_base=BR_API_BASE):
+    """Fetch a BR through its JSON API without a browser; None when the URL has no API endpoint."""
+    raw = fetch_br_payload(url, esi, api_base)
+    return None if raw is None else br_report_from_payload(raw)
+
+
+def br_report_from_payload(raw, pilot_filter=None):
+    """Parse a fetched BR payload: an 'api' payload, an in-page 'scan' or page 'html'."""
+    with tracer.span('br.parse', kind=raw['kind']):
+        if raw['kind'] == 'api':
+            return br_payload_to_report(raw['payload'], raw['names'], pilot_filter)
+        if raw['kind'] == 'scan':
+            return build_br_report(raw['scan'], pilot_filter)
+        if raw['kind'] == 'html':
+            return parse_br_html(raw['html'], pilot_filter)
+    raise ValueError(f"Unknown BR payload kind {raw['kind']!r}")
+
+
+# Character names almost never change, so ids are kept for a month unless ESI says otherwise
+ESI_NAME_CACHE_TTL = 30 * 24 * 3600
+ESI_NAME_CACHE_MAX_ENTRIES = 50000
+
+
+def _expires_from_headers(headers, default_ttl, now):
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return now + default_ttl
+
+
+class EsiNameCache:
+    """Persistent character name -> id cache in front of ESI /universe/ids/.
+
+    Fresh entries are served locally, stale entries are revalidated with a
+    conditional GET on /characters/{id}/ and only unknown names are posted
+    to ESI.
+    """
+
+    def __init__(self, path=None, ttl=ESI_NAME_CACHE_TTL, max_entries=ESI_NAME_CACHE_MAX_ENTRIES, esi=None):
+        self.path = Path(path) if path else APP_DATA_DIR / 'esi_names.sqlite3'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.esi = esi or EsiClient()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bytes_saved': 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS names ("
+            "name TEXT PRIMARY KEY, character_id TEXT NOT NULL, etag TEXT, "
+            "expires REAL NOT NULL, last_used REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS names_last_used ON names (last_used)")
+        self._db.commit()
+
+    def resolve(self, names, on_batch=None):
+        """Return {name: character_id} for every name ESI knows.
+
+        on_batch, if given, is called with each partial {name: character_id}
+        as soon as it is known: cache hits first, then each ESI chunk.
+        """
+        now = time.time()
+        resolved = {}
+        stale = []
+        with self._lock:
+            for name in dict.fromkeys(names):
+                row = self._db.execute(
+                    "SELECT character_id, etag, expires, size FROM names WHERE name = ?", (name,)
+                ).fetchone()
+                if row is None:
+                    continue
+                character_id, etag, expires, size = row
+                if expires > now:
+                    resolved[name] = character_id
+                    self.stats['hits'] += 1
+                    self.stats['bytes_saved'] += size
+                else:
+                    stale.append((name, character_id, etag))
+        if on_batch and resolved:
+            on_batch(dict(resolved))
+
+        revalidated = self.esi.map(lambda entry: self._revalidate(*entry, now), stale)
+        confirmed = {name: character_id for (name, character_id, _etag), still_valid in zip(stale, revalidated) if still_valid}
+        resolved.update(confirmed)
+        if on_batch and confirmed:
+            on_batch(confirmed)
+
+        misses = [name for name in dict.fromkeys(names) if name not in resolved]
+        self.stats['misses'] += len(misses)
+        if misses:
+            resolved.update(self._lookup(misses, now, on_batch))
+
+        with self._lock:
+            self._db.executemany(
+                "UPDATE names SET last_used = ? WHERE name = ?", [(now, name) for name in resolved]
+            )
+            self._evict()
+            self._db.commit()
+        return resolved
+
+    def _revalidate(self, name, character_id, etag, now):
+        import requests
+
+        headers = {'If-None-Match': etag} if etag else {}
+        try:
+            response = self.esi.request('GET', f"/characters/{character_id}/", headers=headers)
+        except requests.RequestException as e:
+            print(f"Error revalidating {name}: {e}")
+            return False
+        if response.status_code != 304 and (response.status_code != 200 or (response.json() or {}).get('name') != name):
+            with self._lock:
+                self._db.execute("DELETE FROM names WHERE name = ?", (name,))
+            return False
+        # The character sheet's own Expires covers corp/alliance data that changes
+        # often; the name -> id mapping it confirms stays good for the full TTL.
+        with self._lock:
+            self.stats['revalidated'] += 1
+            if response.status_code == 304:
+                self.stats['bytes_saved'] += int(response.headers.get('Content-Length') or 0)
+            self._db.execute(
+                "UPDATE names SET etag = ?, expires = ? WHERE name = ?",
+                (response.headers.get('ETag', etag), now + self.ttl, name),
+            )
+        return True
+
+    def _lookup(self, names, now, on_batch=None):
+        found = {}
+
+        def store(response):
+            expires = _expires_from_headers(response.headers, self.ttl, now)
+            characters = (response.json() or {}).get('characters', [])
+            rows = [(item['name'], str(item['id']), None, expires, now, len(json.dumps(item))) for item in characters]
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?, ?)", rows)
+            batch = {item['name']: str(item['id']) for item in characters}
+            found.update(batch)
+            if on_batch and batch:
+                on_batch(batch)
+
+        self.esi.post_chunks('/universe/ids/', names, ESI_IDS_CHUNK, on_response=store)
+        return found
+
+    def _evict(self):
+        (count,) = self._db.execute("SELECT COUNT(*) FROM names").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM names WHERE name IN (SELECT name FROM names ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def summary(self):
+        return ("ESI name cache: {hits} hits, {misses} misses, {revalidated} revalidated, "
+                "{bytes_saved:,} bytes saved").format(**self.stats)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# ESI accepts up to 1000 character ids per /characters/affiliation/ POST and caches answers for an hour
+ESI_AFFILIATION_CHUNK = 1000
+ESI_AFFILIATION_TTL = 3600
+
+
+class EsiAffiliationCache:
+    """Persistent character id -> (corporation id, alliance id) cache in front of
+    ESI /characters/affiliation/.
+
+    Entries expire when ESI says they do, since pilots move between corps far
+    more often than they change names.
+    """
+
+    def __init__(self, path=None, ttl=ESI_AFFILIATION_TTL, esi=None):
+        self.path = Path(path) if path else APP_DATA_DIR / 'esi_affiliations.sqlite3'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.esi = esi or EsiClient()
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS affiliations ("
+            "character_id TEXT PRIMARY KEY, corporation_id TEXT NOT NULL, alliance_id TEXT, "
+            "expires REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def resolve(self, character_ids):
+        """Return {character_id: (corporation_id, alliance_id)} for every id ESI knows.
+
+        alliance_id is None for pilots whose corporation is not in an alliance.
+        """
+        now = time.time()
+        character_ids = list(dict.fromkeys(str(character_id) for character_id in character_ids))
+        resolved = {}
+        with self._lock:
+            expired = []
+            for character_id in character_ids:
+                row = self._db.execute(
+                    "SELECT corporation_id, alliance_id, expires FROM affiliations WHERE character_id = ?",
+                    (character_id,),
+                ).fetchone()
+                if row is not None and row[2] > now:
+                    resolved[character_id] = (row[0], row[1])
+                elif row is not None:
+                    expired.append(character_id)
+            self._db.executemany("DELETE FROM affiliations WHERE character_id = ?", [(i,) for i in expired])
+            self._db.commit()
+        self.stats['hits'] += len(resolved)
+
+        misses = [character_id for character_id in character_ids if character_id not in resolved]
+        self.stats['misses'] += len(misses)
+        if misses:
+            resolved.update(self._lookup(misses, now))
+        return resolved
+
+    def _lookup(self, character_ids, now):
+        found = {}
+
+        def store(response):
+            expires = _expires_from_headers(response.headers, self.ttl, now)
+            batch = {}
+            for item in response.json() or []:
+                ally_id = item.get('alliance_id')
+                batch[str(item['character_id'])] = (str(item['corporation_id']), str(ally_id) if ally_id else None)
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO affiliations VALUES (?, ?, ?, ?)",
+                    [(character_id, corp_id, ally_id, expires) for character_id, (corp_id, ally_id) in batch.items()],
+                )
+                self._db.commit()
+            found.update(batch)
+
+        ids = [int(character_id) for character_id in character_ids if character_id.isdigit()]
+        self.esi.post_chunks('/characters/affiliation/', ids, ESI_AFFILIATION_CHUNK, on_response=store)
+        return found
+
+    def summary(self):
+        return "ESI affiliation cache: {hits} hits, {misses} misses".format(**self.stats)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def pending_affiliations(participants):
+    """Participants with a character id whose corporation and alliance are not known yet."""
+    return [p for p in participants if p.character_id and p.corporation_id is None]
+
+
+def tag_affiliations(participants, affiliations, pilot_filter=None):
+    """Fill in corporation_id/alliance_id from {character_id: (corp, alliance)}.
+
+    Returns the edits (see apply_participant_edits) excluding tagged pilots the
+    filter's corporation/alliance rules exclude or that are outside its friendly
+    corporations and alliances, if any are set.
+    """
+    pilot_filter = pilot_filter or default_pilot_filter()
+    edits = []
+    for participant in participants:
+        affiliation = affiliations.get(participant.character_id)
+        if affiliation is None:
+            continue
+        participant.corporation_id, participant.alliance_id = affiliation
+        if participant.included and (
+            pilot_filter.excludes(participant.name, *affiliation) or not pilot_filter.is_friendly(*affiliation)
+        ):
+            edits.append((participant, 'included', False))
+    return edits
+
+
+BR_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+
+def normalize_br_url(url):
+    """Canonical form of a BR URL, used as its cache key."""
+    parsed = urlparse(url.strip())
+    path = re.sub(r'/+', '/', parsed.path).rstrip('/')
+    return f"{(parsed.scheme or 'https').lower()}://{parsed.netloc.lower()}{path.lower()}"
+
+
+class BRCache:
+    """Fetched BR payloads on disk, keyed by normalized URL.
+
+    Payloads are stored once per content hash as compressed JSON, so URLs
+    that resolve to the same data share a blob. The least recently used
+    URLs are dropped once the blobs grow past max_bytes.
+    """
+
+    def __init__(self, path=None, max_bytes=BR_CACHE_MAX_BYTES):
+        self.path = Path(path) if path else APP_DATA_DIR / 'br_cache.sqlite3'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, data BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, digest TEXT NOT NULL, fetched_at REAL NOT NULL, last_used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used);"
+            "CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest);"
+        )
+        self._db.commit()
+
+    def get(self, url):
+        """Return the cached payload for url, or None."""
+        key = normalize_br_url(url)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT data FROM pages JOIN blobs USING (digest) WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET last_used = ? WHERE url = ?", (time.time(), key))
+        try:
+            return json.loads(zlib.decompress(row[0]))
+        except (zlib.error, ValueError) as e:
+            print(f"Ignoring unreadable BR cache entry for {key}: {e}")
+            return None
+
+    def put(self, url, raw):
+        """Store a payload for url and return its content hash."""
+        encoded = json.dumps(raw, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        data = zlib.compress(encoded)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO blobs (digest, size, data) VALUES (?, ?, ?)", (digest, len(data), data))
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, digest, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+                (normalize_br_url(url), digest, now, now),
+            )
+            self._drop_orphans()
+            self._evict()
+        return digest
+
+    def _drop_orphans(self):
+        self._db.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM pages)")
+
+    def _evict(self):
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        if total <= self.max_bytes:
+            return
+        # A blob is as recent as the most recently used URL that points at it
+        for digest, size in self._db.execute(
+            "SELECT digest, size FROM blobs JOIN (SELECT digest, MAX(last_used) AS used FROM pages GROUP BY digest) "
+            "USING (digest) ORDER BY used"
+        ).fetchall():
+            self._db.execute("DELETE FROM pages WHERE digest = ?", (digest,))
+            self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            total -= size
+            if total <= self.max_bytes:
+                return
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM pages WHERE url = ?", (normalize_br_url(url),)).fetchone() is not None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def period_bounds(period):
+    """Return (start, end) epoch seconds for 'YYYY-MM' or 'YYYY-MM-DD' in local time."""
+    try:
+        parts = [int(part) for part in period.split('-')]
+    except ValueError:
+        raise ValueError(f"Expected YYYY-MM or YYYY-MM-DD, got {period!r}") from None
+    if len(parts) == 2:
+        start = datetime(parts[0], parts[1], 1)
+        end = datetime(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+    elif len(parts) == 3:
+        start = datetime(*parts)
+        end = start + timedelta(days=1)
+    else:
+        raise ValueError(f"Expected YYYY-MM or YYYY-MM-DD, got {period!r}")
+    return start.timestamp(), end.timestamp()
+
+
+class PayoutLedger:
+    """SQLite record of every op's buyback and per-pilot payouts.
+
+    Pilots are keyed by character id, or by lowercased name when the id is
+    unknown, and payout rows carry the op time so per-pilot/per-period
+    totals are answered from one index.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else APP_DATA_DIR / 'ledger.sqlite3'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS ops ("
+            " id INTEGER PRIMARY KEY, recorded_at REAL NOT NULL, buyback_cents INTEGER NOT NULL,"
+            " dynamic_shares INTEGER NOT NULL, note TEXT);"
+            "CREATE TABLE IF NOT EXISTS payouts ("
+            " op_id INTEGER NOT NULL REFERENCES ops(id) ON DELETE CASCADE, recorded_at REAL NOT NULL,"
+            " pilot TEXT NOT NULL, character_id TEXT, name TEXT NOT NULL, included INTEGER NOT NULL,"
+            " scout INTEGER NOT NULL, num_shares INTEGER NOT NULL, share_cents INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS ops_recorded_at ON ops (recorded_at);"
+            "CREATE INDEX IF NOT EXISTS payouts_op ON payouts (op_id);"
+            "CREATE INDEX IF NOT EXISTS payouts_pilot_time ON payouts (pilot, recorded_at);"
+            "CREATE INDEX IF NOT EXISTS payouts_time_pilot ON payouts (recorded_at, pilot, included, share_cents);"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def pilot_key(participant):
+        if participant.character_id is not None:
+            return str(participant.character_id)
+        return 'name:' + ParticipantStore.normalize_name(participant.name)
+
+    def record_op(self, participants, buyback_isk, dynamic, op_id=None, note=None, recorded_at=None):
+        """Store an op and its payouts; passing op_id replaces that op's earlier record. Returns the op id."""
+        recorded_at = time.time() if recorded_at is None else recorded_at
+        with self._lock, self._db:
+            if op_id is not None:
+                self._db.execute("DELETE FROM payouts WHERE op_id = ?", (op_id,))
+                self._db.execute("DELETE FROM ops WHERE id = ?", (op_id,))
+            cursor = self._db.execute(
+                "INSERT INTO ops (id, recorded_at, buyback_cents, dynamic_shares, note) VALUES (?, ?, ?, ?, ?)",
+                (op_id, recorded_at, isk_to_cents(buyback_isk), int(bool(dynamic)), note),
+            )
+            op_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO payouts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (op_id, recorded_at, self.pilot_key(p), p.character_id, p.name, int(p.included),
+                     int(p.scout), p.num_shares, isk_to_cents(p.share))
+                    for p in participants
+                ],
+            )
+        return op_id
+
+    def _period_clause(self, start, end):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("recorded_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("recorded_at < ?")
+            params.append(end)
+        return (" AND " + " AND ".join(clauses) if clauses else ""), params
+
+    def pilot_totals(self, start=None, end=None):
+        """Rows of (pilot, character_id, name, ops_attended, scout_ops, total_isk) for the period, largest total first."""
+        where, params = self._period_clause(start, end)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT pilot, MAX(character_id), MAX(name), COUNT(*), SUM(scout), SUM(share_cents)"
+                " FROM payouts WHERE included = 1" + where +
+                " GROUP BY pilot ORDER BY SUM(share_cents) DESC",
+                params,
+            ).fetchall()
+        return [row[:5] + (cents_to_isk(row[5]),) for row in rows]
+
+    def pilot_history(self, participant_or_key, start=None, end=None):
+        """Rows of (op_id, recorded_at, included, scout, num_shares, share_isk) for one pilot."""
+        key = participant_or_key if isinstance(participant_or_key, str) else self.pilot_key(participant_or_key)
+        where, params = self._period_clause(start, end)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT op_id, recorded_at, included, scout, num_shares, share_cents FROM payouts"
+                " WHERE pilot = ?" + where + " ORDER BY recorded_at",
+                [key] + params,
+            ).fetchall()
+        return [row[:5] + (cents_to_isk(row[5]),) for row in rows]
+
+    def export_csv(self, out, start=None, end=None, totals=True):
+        """Write per-pilot totals (or every payout row with totals=False) for the period as CSV to a file object."""
+        writer = csv.writer(out)
+        if totals:
+            writer.writerow(['character_id', 'name', 'ops_attended', 'scout_ops', 'total_isk'])
+            for _pilot, character_id, name, attended, scout_ops, total in self.pilot_totals(start, end):
+                writer.writerow([character_id or '', name, attended, scout_ops, f"{total:.2f}"])
+            return
+        where, params = self._period_clause(start, end)
+        writer.writerow(['op_id', 'recorded_at', 'buyback_isk', 'character_id', 'name', 'included', 'scout',
+                         'num_shares', 'share_isk'])
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT p.op_id, p.recorded_at, o.buyback_cents, p.character_id, p.name, p.included, p.scout,"
+                " p.num_shares, p.share_cents FROM payouts p JOIN ops o ON o.id = p.op_id"
+                " WHERE 1 = 1" + where.replace("recorded_at", "p.recorded_at") + " ORDER BY p.recorded_at, p.op_id",
+                params,
+            )
+            for op_id, recorded_at, buyback, character_id, name, included, scout, num_shares, share in rows:
+                writer.writerow([
+                    op_id, datetime.fromtimestamp(recorded_at).isoformat(timespec='seconds'),
+                    f"{cents_to_isk(buyback):.2f}", character_id or '', name, included, scout, num_shares,
+                    f"{cents_to_isk(share):.2f}",
+                ])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# A BR page counts as loaded once both team headers and pilot links are in the DOM
+BR_READY_SELECTOR = "h4:has-text('Team')"
+BR_CHARACTER_SELECTOR = "a[href*='/character/']"
+# Scan the live DOM with BR_SCAN_SCRIPT instead of copying page.content() into Python
+BR_IN_PAGE_EXTRACTION = True
+BR_POLL_INTERVAL_MS = 250
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+def _raise_if_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ImportCancelled()
+
+
+class BrowserWorker:
+    """Keeps one headless Chromium warm on a dedicated thread.
+
+    The Playwright sync API is bound to the thread that started it, so every
+    browser call is queued to this thread and the caller waits on a Future.
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._browser_ready = None
+
+    def prepare(self, on_output=None):
+        """Check for Chromium, installing it if missing, on a background thread.
+
+        Only the first call starts the check; every call returns the same Future.
+        """
+        with self._lock:
+            if self._browser_ready is None:
+                self._browser_ready = Future()
+                threading.Thread(
+                    target=self._install_browser_if_missing, args=(self._browser_ready, on_output),
+                    name="br-browser-install", daemon=True,
+                ).start()
+            return self._browser_ready
+
+    def _install_browser_if_missing(self, ready, on_output):
+        try:
+            with tracer.span('browser.check_install'):
+                installed = _chromium_installed()
+            if not installed:
+                print("Playwright browser not found; starting download...")
+                if on_output:
+                    on_output("Downloading Playwright Chromium (first run only)...\n")
+                with tracer.span('browser.install'):
+                    _install_playwright_browser(on_output=on_output)
+            ready.set_result(True)
+        except Exception as exc:
+            with self._lock:
+                # Let the next import try the install again
+                self._browser_ready = None
+            ready.set_exception(exc)
+
+    def _run(self):
+        try:
+            self.prepare().result()
+            with tracer.span('browser.playwright_start'):
+                from playwright.sync_api import sync_playwright
+
+                playwright = sync_playwright().start()
+        except Exception as exc:
+            # Fail everything already queued so no caller waits forever; the next submit retries
+            with self._lock:
+                self._thread = None
+                while True:
+                    try:
+                        job = self._jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    # Skip futures whose caller already cancelled them
+                    if job is not None and job[1].set_running_or_notify_cancel():
+                        job[1].set_exception(exc)
+
+        browser = None
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                func, future, on_progress, cancel_event = job
+                # A caller that gave up while Chromium was being installed has cancelled its future
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if browser is None or not browser.is_connected():
+                        _raise_if_cancelled(cancel_event)
+                        if on_progress:
+                            on_progress("Launching browser...")
+                        with tracer.span('browser.launch'):
+                            browser = _launch_chromium_with_retry(playwright)
+                    _raise_if_cancelled(cancel_event)
+                    future.set_result(func(browser))
+                except Exception as exc:
+                    future.set_exception(exc)
+        finally:
+            if browser is not None:
+                browser.close()
+            playwright.stop()
+
+    def submit(self, func, on_progress=None, cancel_event=None):
+        """Run func(browser) on the browser thread and return a Future for its result.
+
+        If cancel_event is set before the browser is up, func is not run and
+        the Future fails with ImportCancelled.
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="br-browser", daemon=True)
+                self._thread.start()
+            self._jobs.put((func, future, on_progress, cancel_event))
+        return future
+
+    def _load_br_pages(self, urls, collect, timeout, cancel_event=None, on_progress=None):
+        """Load several BR pages in parallel browser contexts and run collect(page) on each.
+
+        Returns one result per url, in order; a page that failed gives its exception instead.
+        """
+        def wait_ready(page):
+            from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+            # Wait in short slices so a cancel request is noticed while the page is loading
+            deadline = time.monotonic() + timeout / 1000
+            for selector in (BR_READY_SELECTOR, BR_CHARACTER_SELECTOR):
+                while True:
+                    _raise_if_cancelled(cancel_event)
+                    try:
+                        page.wait_for_selector(selector, timeout=BR_POLL_INTERVAL_MS)
+                        break
+                    except PlaywrightTimeoutError:
+                        if time.monotonic() > deadline:
+                            raise
+
+        def load(browser):
+            from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+            contexts = []
+            pages = []
+            try:
+                if on_progress:
+                    on_progress("Loading battle report page..." if len(urls) == 1 else f"Loading {len(urls)} battle report pages...")
+                # goto waits at most one poll slice for the response to start. A slow
+                # server's navigation carries on in the background and wait_ready, which
+                # checks for cancel between slices, waits for it up to the full timeout.
+                for url in urls:
+                    _raise_if_cancelled(cancel_event)
+                    context = browser.new_context()
+                    contexts.append(context)
+                    page = context.new_page()
+                    try:
+                        with tracer.span('page.goto', url=url):
+                            page.goto(url, timeout=BR_POLL_INTERVAL_MS, wait_until="commit")
+                        pages.append(page)
+                    except PlaywrightTimeoutError:
+                        pages.append(page)
+                    except Exception as exc:
+                        pages.append(exc)
+
+                results = []
+                for index, page in enumerate(pages):
+                    if isinstance(page, Exception):
+                        results.append(page)
+                        continue
+                    try:
+                        with tracer.span('page.wait_ready'):
+                            wait_ready(page)
+                        if on_progress:
+                            on_progress("Reading pilots..." if len(urls) == 1 else f"Reading pilots ({index + 1}/{len(urls)})...")
+                        with tracer.span('page.extract'):
+                            results.append(collect(page))
+                    except ImportCancelled:
+                        raise
+                    except Exception as exc:
+                        results.append(exc)
+                return results
+            finally:
+                # Closing a context also aborts a navigation that is still in flight
+                for context in contexts:
+                    context.close()
+
+        _raise_if_cancelled(cancel_event)
+        future = self.submit(load, on_progress, cancel_event)
+        if cancel_event is None:
+            return future.result()
+        # Poll rather than block, so a cancel during the Chromium install or launch returns at once
+        while True:
+            try:
+                return future.result(timeout=BR_POLL_INTERVAL_MS / 1000)
+            except FutureTimeoutError:
+                if cancel_event.is_set():
+                    # A job still queued is dropped; a running one stops at its next check
+                    future.cancel()
+                    raise ImportCancelled() from None
+
+    def fetch_payloads(self, urls, timeout=60000, cancel_event=None, on_progress=None):
+        """Load several BR pages; returns a payload for br_report_from_payload or the exception for each url."""
+        if BR_IN_PAGE_EXTRACTION:
+            collect = lambda page: {'kind': 'scan', 'scan': page.evaluate(BR_SCAN_SCRIPT)}
+        else:
+            collect = lambda page: {'kind': 'html', 'html': page.content()}
+        return self._load_br_pages(urls, collect, timeout, cancel_event, on_progress)
+
+    def shutdown(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            thread.join(timeout=5)
+
+
+BR_MAX_CONCURRENT_IMPORTS = 6
+
+
+def fetch_br_reports(urls, esi=None, browser_worker=None, cancel_event=None, on_progress=None, cache=None, refresh=False,
+                     pilot_filter=None):
+    """Fetch several BRs at once; returns a BattleReport or the exception for each url, in order.
+
+    BRs in cache are parsed straight from disk unless refresh is set. The rest
+    try the JSON API concurrently, then the ones without an API result are
+    loaded together in one browser pass. Fetched payloads are added to cache.
+    """
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise ImportCancelled()
+
+    def fetch_api(url):
+        try:
+            with tracer.span('br_import.api', url=url):
+                return fetch_br_payload(url, esi=esi)
+        except Exception as e:
+            print(f"BR API fetch failed for {url}, falling back to browser: {e}")
+            return None
+
+    def parse(raw):
+        try:
+            return br_report_from_payload(raw, pilot_filter)
+        except Exception as exc:
+            return exc
+
+    urls = list(urls)
+    results = [None] * len(urls)
+    raws = {}
+    if cache is not None and not refresh:
+        with tracer.span('br_cache.get', urls=len(urls)):
+            for index, url in enumerate(urls):
+                raw = cache.get(url)
+                if raw is not None:
+                    raws[index] = raw
+        if raws and on_progress:
+            on_progress(f"Loaded {len(raws)} battle report{'s' if len(raws) > 1 else ''} from cache")
+    cached = set(raws)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(urls), BR_MAX_CONCURRENT_IMPORTS)), thread_name_prefix="br-fetch")
+    try:
+        futures = {pool.submit(fetch_api, url): index for index, url in enumerate(urls) if index not in cached}
+        pending = set(futures)
+        # Wait in short slices so a cancel is noticed during a slow API or ESI call;
+        # the abandoned fetches finish on their own threads and are ignored
+        while pending:
+            check_cancelled()
+            try:
+                for future in as_completed(pending, timeout=BR_POLL_INTERVAL_MS / 1000):
+                    pending.discard(future)
+                    raw = future.result()
+                    if raw is not None:
+                        raws[futures[future]] = raw
+                    if on_progress and len(futures) > 1:
+                        on_progress(f"Fetched {len(futures) - len(pending)}/{len(futures)} battle reports")
+                    check_cancelled()
+            except FutureTimeoutError:
+                pass
+        indices = sorted(raws)
+        for index, report in zip(indices, pool.map(parse, [raws[index] for index in indices])):
+            results[index] = report
+
+        fallback = [
+            index for index, report in enumerate(results)
+            if index not in cached and not (isinstance(report, BattleReport) and report.teams)
+        ]
+        if fallback and browser_worker is None:
+            for index in fallback:
+                results[index] = RuntimeError(f"{urls[index]} needs the browser fallback, which is not available")
+        elif fallback:
+            with tracer.span('br_import.browser', pages=len(fallback)):
+                payloads = browser_worker.fetch_payloads(
+                    [urls[index] for index in fallback], cancel_event=cancel_event, on_progress=on_progress
+                )
+            fetched = [(index, raw) for index, raw in zip(fallback, payloads) if not isinstance(raw, Exception)]
+            for index, raw in zip(fallback, payloads):
+                if isinstance(raw, Exception):
+                    results[index] = raw
+            for (index, raw), report in zip(fetched, pool.map(parse, [raw for _, raw in fetched])):
+                raws[index] = raw
+                results[index] = report
+        check_cancelled()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if cache is not None:
+        for index, raw in raws.items():
+            if index not in cached and isinstance(results[index], BattleReport) and results[index].teams:
+                try:
+                    cache.put(urls[index], raw)
+                except sqlite3.Error as e:
+                    print(f"Could not cache {urls[index]}: {e}")
+    return results
+
+
+class BRImportJob:
+    """Fetches and parses one or more BRs on a background thread.
+
+    Progress, the result and errors are posted to `events` as (kind, value)
+    tuples for the GUI to poll: ('progress', text), ('done', [(url, report)])
+    where report is a BattleReport or the exception that url failed with,
+    ('error', exception) when every url failed, or ('cancelled', None).
+    """
+
+    def __init__(self, urls, esi, browser_worker, cache=None, refresh=False):
+        self.urls = list(urls)
+        self.esi = esi
+        self.browser_worker = browser_worker
+        self.cache = cache
+        self.refresh = refresh
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="br-import", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _progress(self, text):
+        self.events.put(('progress', text))
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ImportCancelled()
+
+    def _run(self):
+        with tracer.span('br_import', urls=len(self.urls)):
+            self._import()
+
+    def _import(self):
+        try:
+            # The Chromium check runs alongside the API fetch so a browser fallback doesn't wait on it
+            self.browser_worker.prepare(on_output=lambda line: self._progress(line.strip()) if line.strip() else None)
+            self._progress("Fetching battle report..." if len(self.urls) == 1 else f"Fetching {len(self.urls)} battle reports...")
+            reports = fetch_br_reports(
+                self.urls, self.esi, self.browser_worker, self.cancel_event, self._progress, self.cache, self.refresh
+            )
+            self._check_cancelled()
+
+            failures = [report for report in reports if isinstance(report, Exception)]
+            if len(failures) == len(reports):
+                raise failures[0]
+            pilots = {
+                char['id'] for report in reports if not isinstance(report, Exception)
+                for team in report.teams.values() for char in team.characters
+            }
+            self._progress(f"{len(pilots)} pilots found")
+            self.events.put(('done', list(zip(self.urls, reports))))
+        except ImportCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+
+
+class VirtualParticipantView:
+    """Shows a scrolling window onto a large row list using a fixed set of Treeview items.
+
+    Only the rows that fit on screen exist as items. Scrolling, filtering and
+    sorting rewrite those items in place instead of inserting or moving rows.
+    Rows are (key, values, tags, sort_values); selection is tracked by key so
+    it survives scrolling.
+    """
+
+    DEFAULT_ROW_HEIGHT = 20
+    DEFAULT_HEADER_HEIGHT = 24
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.rows = []
+        self.selected = set()
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+        self._names = []
+        self._order = []
+        self._offset = 0
+        self._window = int(tree.cget("height")) or 1
+        self._slots = []
+        self._slot_keys = []
+        self._rendered = {}
+        self._headings = {column: tree.heading(column, "text") for column in tree["columns"]}
+
+        scrollbar.config(command=self.yview)
+        for column in tree["columns"]:
+            tree.heading(column, command=lambda c=column: self.sort_by(c))
+        tree.bind("<Configure>", self._on_resize)
+        tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units", 3))
+        tree.bind("<Button-4>", lambda e: self.scroll(-1, "units", 3))
+        tree.bind("<Button-5>", lambda e: self.scroll(1, "units", 3))
+        tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        tree.bind("<ButtonPress-1>", self._on_click, add="+")
+        tree.bind("<<TreeviewSelect>>", self._on_select)
+
+    def set_rows(self, rows):
+        """Replace the row list, keeping the current filter, sort order and scroll position."""
+        self.rows = rows
+        # Forget selected rows that no longer exist so bulk edits never reach a removed pilot
+        self.selected.intersection_update(key for key, _, _, _ in rows)
+        # Prebuilt lowercase name index for the search box
+        self._names = [values[2].lower() for _, values, _, _ in rows]
+        self._rebuild_order()
+
+    def set_filter(self, text):
+        text = text.strip().lower()
+        if text == self.filter_text:
+            return
+        # Typing more characters only narrows the current matches
+        narrowing = self.filter_text and text.startswith(self.filter_text)
+        self.filter_text = text
+        if narrowing:
+            names = self._names
+            self._order = [index for index in self._order if text in names[index]]
+            self._offset = 0
+            self._render()
+        else:
+            self._offset = 0
+            self._rebuild_order()
+
+    def sort_by(self, column):
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, False
+        for name, text in self._headings.items():
+            arrow = (" \u25bc" if self.sort_reverse else " \u25b2") if name == column else ""
+            self.tree.heading(name, text=text + arrow)
+        self._offset = 0
+        self._rebuild_order()
+
+    def key_for(self, iid):
+        """The row key shown in tree item iid, or None."""
+        try:
+            return self._slot_keys[self._slots.index(iid)]
+        except ValueError:
+            return None
+
+    def scroll(self, amount, what="units", step=1):
+        if what == "pages":
+            step = max(1, self._window - 1)
+        self._offset += amount * step
+        self._render()
+        return "break"
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self._offset = int(float(args[1]) * len(self._order))
+            self._render()
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
+
+    def _rebuild_order(self):
+        indices = range(len(self.rows))
+        if self.filter_text:
+            names = self._names
+            indices = [index for index in indices if self.filter_text in names[index]]
+        if self.sort_column is not None:
+            column = self.tree["columns"].index(self.sort_column)
+            rows = self.rows
+            indices = sorted(indices, key=lambda index: rows[index][3][column], reverse=self.sort_reverse)
+        self._order = list(indices)
+        self._render()
+
+    def _render(self):
+        total = len(self._order)
+        self._offset = max(0, min(self._offset, total - self._window))
+        window = self._order[self._offset:self._offset + self._window]
+
+        while len(self._slots) < len(window):
+            iid = f"row{len(self._slots)}"
+            self.tree.insert("", tk.END, iid=iid)
+            self._slots.append(iid)
+            self._rendered[iid] = None
+        while len(self._slots) > len(window):
+            iid = self._slots.pop()
+            self.tree.delete(iid)
+            del self._rendered[iid]
+
+        self._slot_keys = []
+        selection = []
+        for iid, index in zip(self._slots, window):
+            key, values, tags, _ = self.rows[index]
+            self._slot_keys.append(key)
+            if self._rendered[iid] != (values, tags):
+                self.tree.item(iid, values=values, tags=tags)
+                self._rendered[iid] = (values, tags)
+            if key in self.selected:
+                selection.append(iid)
+        if set(selection) != set(self.tree.selection()):
+            self.tree.selection_set(selection)
+
+        if total:
+            self.scrollbar.set(self._offset / total, (self._offset + len(window)) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_resize(self, event):
+        row_height, header_height = self.DEFAULT_ROW_HEIGHT, self.DEFAULT_HEADER_HEIGHT
+        bbox = self.tree.bbox(self._slots[0]) if self._slots else None
+        if bbox:
+            header_height, row_height = bbox[1], bbox[3]
+        window = max(1, (event.height - header_height) // row_height)
+        if window != self._window:
+            self._window = window
+            self._render()
+
+    def _on_click(self, event):
+        # A plain click starts a new selection, so forget rows selected off screen
+        if not event.state & 0x0005:
+            self.selected.clear()
+
+    def _on_select(self, event):
+        on_screen = set(self._slot_keys)
+        self.selected = {key for key in self.selected if key not in on_screen}
+        self.selected.update(self.key_for(iid) for iid in self.tree.selection())
+        self.selected.discard(None)
+
 
 class FCPayoutApp:
     def __init__(self, root):
@@ -212,9 +2452,40 @@ class FCPayoutApp:
         self.root.title("FC Payout Tool")
 
         self.default_dynamic_shares = None
-
-        self.participants = []
-        self.buyback_isk = 0.0
+        self.browser_worker = transport.wrap_browser(BrowserWorker())
+        self.br_import_job = None
+        # BR url -> team letter picked for it this session
+        self.br_team_choices = {}
+        self.pending_id_names = set()
+        self.esi = EsiClient()
+        self.ledger_op_id = None
+        try:
+            self.ledger = PayoutLedger()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not open payout ledger, payouts will not be recorded: {e}")
+            self.ledger = None
+        # Record and replay runs start with empty caches so every request goes through the transport
+        cache_path = ':memory:' if transport.isolated else None
+        try:
+            self.name_cache = EsiNameCache(cache_path, esi=self.esi)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not open ESI name cache, using a session-only cache: {e}")
+            self.name_cache = EsiNameCache(':memory:', esi=self.esi)
+        try:
+            self.br_cache = BRCache(cache_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not open BR cache, using a session-only cache: {e}")
+            self.br_cache = BRCache(':memory:')
+        try:
+            self.affiliation_cache = EsiAffiliationCache(cache_path, esi=self.esi)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not open ESI affiliation cache, using a session-only cache: {e}")
+            self.affiliation_cache = EsiAffiliationCache(':memory:', esi=self.esi)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self.participants = ParticipantStore()
+        self.buyback_isk = Decimal(0)
+        self.payout_rules = DEFAULT_PAYOUT_RULES
         self.last_buyback_value = "0.00"
 
         tk.Label(root, text="Buyback Settings:").pack(anchor="w", padx=8, pady=(10, 0))
@@ -248,17 +2519,46 @@ class FCPayoutApp:
         tk.Button(button_frame, text="Toggle Dynamic Shares", command=self.toggle_dynamic_shares, bg="#66ffff").pack(
             side=tk.LEFT, padx=4, expand=True
         )
+        tk.Button(button_frame, text="Export Ledger", command=self.export_ledger, bg="#d9b3ff").pack(
+            side=tk.LEFT, padx=4, expand=True
+        )
 
-        tk.Label(root, text="Participants:").pack(anchor="w", padx=8, pady=(10, 0))
-        self.participant_tree = ttk.Treeview(root, columns=("Include", "Scout", "Name", "Found ID", "Share Count", "Share"), show="headings")
+        tk.Label(root, text="Selected Participants:").pack(anchor="w", padx=8, pady=(10, 0))
+        bulk_frame = tk.Frame(root)
+        bulk_frame.pack(pady=4, fill=tk.X)
+        for text, command in (
+            ("Include", lambda: self.edit_selected('included', True)),
+            ("Exclude", lambda: self.edit_selected('included', False)),
+            ("Mark Scout", lambda: self.edit_selected('scout', True)),
+            ("Mark Line", lambda: self.edit_selected('scout', False)),
+            ("Set Shares", self.set_selected_shares),
+            ("Mark Scouts by Name", self.mark_scouts_by_name),
+        ):
+            tk.Button(bulk_frame, text=text, command=command, bg="#e0e0e0").pack(side=tk.LEFT, padx=4, expand=True)
+
+        participants_header = tk.Frame(root)
+        participants_header.pack(fill=tk.X, padx=8, pady=(10, 0))
+        tk.Label(participants_header, text="Participants:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = tk.Entry(participants_header, textvariable=self.search_var, width=30)
+        search_entry.pack(side=tk.RIGHT)
+        tk.Label(participants_header, text="Search:").pack(side=tk.RIGHT, padx=(0, 4))
+
+        tree_frame = tk.Frame(root)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        tree_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
+        tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.participant_tree = ttk.Treeview(tree_frame, columns=("Include", "Scout", "Name", "Found ID", "Share Count", "Share"), show="headings")
         self.participant_tree.tag_configure("excluded", background="#ffd6d6")
         self.participant_tree.tag_configure("included", font=("Segoe UI", 10))
         self.participant_tree.tag_configure("boldshare", font=("Segoe UI", 10, "bold"))
         for col in self.participant_tree["columns"]:
             self.participant_tree.heading(col, text=col)
             self.participant_tree.column(col, anchor="center")
-        self.participant_tree.pack(fill=tk.BOTH, expand=True)
+        self.participant_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.participant_tree.bind("<Double-1>", self.toggle_checkbox)
+        self.tree_view = VirtualParticipantView(self.participant_tree, tree_scrollbar)
+        self.search_var.trace_add("write", lambda *_: self.tree_view.set_filter(self.search_var.get()))
 
         self.count_label = tk.Label(root, text="Scouts: 0 | Line: 0 | Total: 0")
         self.count_label.config(font=("Segoe UI", 11, "bold"))
@@ -268,9 +2568,23 @@ class FCPayoutApp:
         self.footer.config(font=("Segoe UI", 11, "bold"))
         self.footer.pack(pady=4)
 
+    def on_close(self):
+        if self.br_import_job is not None:
+            self.br_import_job.cancel()
+        self.browser_worker.shutdown()
+        self.name_cache.close()
+        self.br_cache.close()
+        self.affiliation_cache.close()
+        self.esi.close()
+        if self.ledger is not None:
+            self.ledger.close()
+        self.root.destroy()
+
     def clear_all(self):
         self.participants.clear()
-        self.buyback_isk = 0.0
+        self.tree_view.selected.clear()
+        self.ledger_op_id = None
+        self.buyback_isk = Decimal(0)
         self.buyback_entry.delete(0, tk.END)
         self.buyback_entry.insert(0, "0.00")
         self.last_buyback_value = "0.00"
@@ -278,10 +2592,11 @@ class FCPayoutApp:
         self.refresh_tree()
 
     def remove_selected(self):
-        selected_ids = set(self.participant_tree.selection())
+        selected_ids = set(self.tree_view.selected)
         if not selected_ids:
             return
-        self.participants = [p for p in self.participants if str(id(p)) not in selected_ids]
+        self.participants.remove_iids(selected_ids)
+        self.tree_view.selected.clear()
         self.refresh_tree()
 
     def toggle_checkbox(self, event):
@@ -294,25 +2609,75 @@ class FCPayoutApp:
 
         column = self.participant_tree.identify_column(event.x)
         if column == '#1':
-            participant.included = not participant.included
+            self.apply_edits([(participant, 'included', not participant.included)])
         elif column == '#2':
-            participant.scout = not participant.scout
+            self.apply_edits([(participant, 'scout', not participant.scout)])
         elif column == '#5':
             raw = simpledialog.askstring("Participant Shares", "Enter the number of shares this participant should recieve.")
             if raw is None:
                 return
             try:
-                participant.num_shares = int(raw.strip())
+                num_shares = int(raw.strip())
             except ValueError:
                 print('Input value is not an integer')
                 return
+            self.apply_edits([(participant, 'num_shares', num_shares)])
         elif column == '#6':
+            import pyperclip
+
             pyperclip.copy(f"{participant.share}")
 
-        self.recalculate_shares()
+    def selected_participants(self):
+        return [p for p in map(self.participants.get_by_iid, self.tree_view.selected) if p is not None]
+
+    def apply_edits(self, edits):
+        """Apply a batch of (participant, attribute, value) edits, then recompute and redraw once."""
+        try:
+            changed = apply_participant_edits(edits)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return 0
+        if changed:
+            self.recalculate_shares()
+        return changed
+
+    def edit_selected(self, attribute, value):
+        selected = self.selected_participants()
+        if not selected:
+            messagebox.showinfo("No Selection", "Select one or more participants first.")
+            return
+        self.apply_edits([(p, attribute, value) for p in selected])
+
+    def set_selected_shares(self):
+        selected = self.selected_participants()
+        if not selected:
+            messagebox.showinfo("No Selection", "Select one or more participants first.")
+            return
+        count = simpledialog.askinteger(
+            "Participant Shares", f"Enter the number of shares for the {len(selected)} selected participants.", minvalue=0
+        )
+        if count is None:
+            return
+        self.apply_edits([(p, 'num_shares', count) for p in selected])
+
+    def mark_scouts_by_name(self):
+        raw = self.ask_multiline_text("Mark Scouts", "Paste the names of the pilots who scouted (any format Import from Paste accepts)")
+        if not raw:
+            return
+        edits = []
+        missing = []
+        for name, _ in iter_pilot_paste(raw):
+            participant = self.participants.get_by_name(name)
+            if participant is None:
+                missing.append(name)
+            else:
+                edits.append((participant, 'scout', True))
+        self.apply_edits(edits)
+        if missing:
+            messagebox.showwarning("Not Found", f"{len(missing)} names are not in the participant list:\n" + "\n".join(missing[:30]))
 
     def _participant_from_iid(self, iid):
-        return next((p for p in self.participants if str(id(p)) == iid), None)
+        return self.participants.get_by_iid(self.tree_view.key_for(iid))
 
     def on_buyback_focus_out(self, event = None):
         raw = self.buyback_entry.get()
@@ -324,7 +2689,7 @@ class FCPayoutApp:
 
         if cleaned != self.last_buyback_value:
             try:
-                self.buyback_isk = float(cleaned)
+                self.buyback_isk = parse_isk(cleaned)
                 self.buyback_entry.delete(0, tk.END)
                 self.buyback_entry.insert(0, f"{self.buyback_isk:,.2f}")
                 self.buyback_entry.config(bg="white")
@@ -340,32 +2705,12 @@ class FCPayoutApp:
         if raw is None:
             return
 
-        # Detect format and parse accordingly
-        if "charID-" in raw:
-            matches = re.findall(r"charID[-: ]?(?P<char_id>\d+)\n(?P<name>.*)", raw)
-            for char_id, name in matches:
-                if name in IGNORED_CHAR_NAMES:
-                    continue
+        names = []
+        for name, char_id in iter_pilot_paste(raw):
+            if char_id is None:
+                names.append(name)
+            else:
                 self.add_participant(Participant(name, character_id=char_id))
-            self.refresh_tree()
-            return
-
-        lines = [line.strip() for line in raw.splitlines() if line.strip()]
-        if "\t" in raw:
-            names = []
-            for line in lines:
-                name = line.split("\t", 1)[0].strip()
-                if name and name not in IGNORED_CHAR_NAMES:
-                    names.append(name)
-        elif "," in raw:
-            names = []
-            for line in lines:
-                for name in line.split(","):
-                    name_fixed = name.strip()
-                    if name_fixed:
-                        names.append(name_fixed)
-        else:
-            names = [line for line in lines if line not in IGNORED_CHAR_NAMES]
 
         self.add_and_lookup_names(names)
 
@@ -373,19 +2718,22 @@ class FCPayoutApp:
         """Fetch battle report data from br.evetools.org"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Import from BR URL")
-        dialog.geometry("450x150")
+        dialog.geometry("500x290")
         dialog.transient(self.root)
 
         result = [None]
 
-        tk.Label(dialog, text="Enter the battle report URL:", font=("Segoe UI", 10)).pack(pady=10)
+        tk.Label(dialog, text="Enter one or more battle report URLs, one per line:", font=("Segoe UI", 10)).pack(pady=10)
 
-        entry = tk.Entry(dialog, width=70, font=("Segoe UI", 10))
-        entry.pack(padx=20, pady=10, fill=tk.X)
+        entry = tk.Text(dialog, width=70, height=6, font=("Segoe UI", 10))
+        entry.pack(padx=20, pady=5, fill=tk.BOTH, expand=True)
         entry.focus_set()
 
+        refresh_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(dialog, text="Refresh battle reports that were already imported", variable=refresh_var).pack(anchor="w", padx=20)
+
         def on_ok():
-            result[0] = entry.get().strip()
+            result[0] = entry.get("1.0", tk.END).strip()
             dialog.destroy()
 
         def on_cancel():
@@ -396,134 +2744,125 @@ class FCPayoutApp:
         tk.Button(button_frame, text="OK", command=on_ok, width=10).pack(side=tk.LEFT, padx=5)
         tk.Button(button_frame, text="Cancel", command=on_cancel, width=10).pack(side=tk.LEFT, padx=5)
 
-        entry.bind("<Return>", lambda e: on_ok())
+        # Ctrl+Enter submits; a plain Enter starts the next URL
+        entry.bind("<Control-Return>", lambda e: on_ok())
 
         dialog.wait_window()
 
-        url = result[0]
-        if not url:
+        if not result[0]:
             return
+        urls = list(dict.fromkeys(result[0].split()))
 
-        try:
-            self.root.config(cursor="watch")
-            self.root.update()
+        if self.br_import_job is not None:
+            messagebox.showinfo("Import in Progress", "A battle report import is already running.")
+            return
 
-            with sync_playwright() as playwright:
-                browser = _launch_chromium_with_retry(playwright)
-                try:
-                    page = browser.new_page()
-                    page.goto(url, timeout=60000)
-                    page.wait_for_timeout(4500)
-                    html = page.content()
-                finally:
-                    browser.close()
-
-            if 'Team A' not in html and 'Team B' not in html:
-                messagebox.showerror("Error", "Page loaded but no team data found. The page may still be loading.")
-                return
+        self.br_import_job = BRImportJob(
+            urls, self.esi, self.browser_worker, cache=self.br_cache, refresh=refresh_var.get()
+        ).start()
+        self.show_import_progress_dialog(self.br_import_job, self.finish_br_import)
 
-            # Parse teams, alliances, corporations, and characters
-            team_headers = list(re.finditer(r'<h4[^>]*>Team ([A-Z])[^<]*</h4>', html))
-            alliance_to_team = {}
-            corp_to_team = {}
-            for idx, match in enumerate(team_headers):
-                team_letter = match.group(1)
-                start = match.end()
-                end = team_headers[idx + 1].start() if idx + 1 < len(team_headers) else len(html)
-                header_chunk = html[start:end]
-
-                for ally_match in re.finditer(r'allyID-(\d+)', header_chunk):
-                    ally_id = ally_match.group(1)
-                    if ally_id not in alliance_to_team:
-                        alliance_to_team[ally_id] = team_letter
-
-                for corp_match in re.finditer(r'corpID-(\d+)', header_chunk):
-                    corp_id = corp_match.group(1)
-                    if corp_id not in corp_to_team:
-                        corp_to_team[corp_id] = team_letter
-
-            # Find all character links and associate with nearby alliance
-            team_characters = {}
-            for match in re.finditer(r'href="[^"]*character/(\d+)/"[^>]*>([^<]+)<', html):
-                char_id = match.group(1)
-                char_name = match.group(2).strip()
-
-                if char_name in IGNORED_CHAR_NAMES:
-                    continue
+    def show_import_progress_dialog(self, job, on_done):
+        """Show import progress and poll the job's event queue until it finishes."""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Importing Battle Report")
+        dialog.geometry("360x140")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
 
-                search_chunk = html[match.start():match.start()+2000]
-                ally_match = re.search(r'allyID-(\d+)', search_chunk)
-                corp_match = re.search(r'corpID-(\d+)', search_chunk)
+        status_var = tk.StringVar(value="Starting...")
+        tk.Label(dialog, textvariable=status_var, font=("Segoe UI", 10)).pack(pady=(14, 8))
+        progress = ttk.Progressbar(dialog, mode="indeterminate", length=300)
+        progress.pack(padx=20)
+        progress.start(12)
 
-                ally_id = ally_match.group(1) if ally_match else None
-                corp_id = corp_match.group(1) if corp_match else None
+        def on_cancel():
+            status_var.set("Cancelling...")
+            cancel_button.config(state=tk.DISABLED)
+            job.cancel()
 
-                team_letter = None
-                if ally_id:
-                    team_letter = alliance_to_team.get(ally_id)
-                if not team_letter and corp_id:
-                    team_letter = corp_to_team.get(corp_id)
+        cancel_button = tk.Button(dialog, text="Cancel", width=10, command=on_cancel)
+        cancel_button.pack(pady=12)
+        dialog.protocol("WM_DELETE_WINDOW", on_cancel)
 
-                if not team_letter:
+        def poll():
+            while True:
+                try:
+                    kind, value = job.events.get_nowait()
+                except queue.Empty:
+                    dialog.after(100, poll)
+                    return
+                if kind == 'progress':
+                    status_var.set(value)
                     continue
-
-                if team_letter not in team_characters:
-                    team_characters[team_letter] = {'chars': [], 'alliances': set(), 'corporations': set()}
-
-                if not any(c['id'] == char_id for c in team_characters[team_letter]['chars']):
-                    team_characters[team_letter]['chars'].append({'id': char_id, 'name': char_name})
-                    if ally_id:
-                        team_characters[team_letter]['alliances'].add(ally_id)
-                    if corp_id:
-                        team_characters[team_letter]['corporations'].add(corp_id)
-
-            # Build final team data with alliance names
-            team_data = []
-            for team_letter in sorted(team_characters.keys()):
-                # Get alliance names
-                alliance_names = []
-                for ally_id in team_characters[team_letter]['alliances']:
-                    ally_name_match = re.search(r'alliance/{}/"[^>]*>([^<]+)<'.format(ally_id), html)
-                    if ally_name_match:
-                        alliance_names.append(ally_name_match.group(1))
-
-                corp_names = []
-                for corp_id in team_characters[team_letter]['corporations']:
-                    corp_name_match = re.search(r'corporation/{}/"[^>]*>([^<]+)<'.format(corp_id), html)
-                    if corp_name_match:
-                        corp_names.append(corp_name_match.group(1))
-
-                affil_names = sorted(set(alliance_names + corp_names))
-
-                team_data.append({
-                    'name': f"Team {team_letter}",
-                    'alliances': ', '.join(affil_names) if affil_names else 'Unknown',
-                    'characters': team_characters[team_letter]['chars']
-                })
-
-            if not team_data:
-                messagebox.showerror("Error", "No teams found.")
+                progress.stop()
+                dialog.destroy()
+                on_done(kind, value)
                 return
 
-            selected_team = self.show_team_selection_dialog(team_data)
-            if selected_team is None:
-                return
+        dialog.after(100, poll)
 
-            count = 0
-            for char in team_data[selected_team]['characters']:
-                self.add_participant(Participant(char['name'], character_id=char['id']))
-                count += 1
+    def finish_br_import(self, kind, results):
+        self.br_import_job = None
+        if kind == 'cancelled':
+            return
+        if kind == 'error':
+            messagebox.showerror("Error", f"Failed to fetch BR: {str(results)}")
+            return
 
+        failed = [(url, report) for url, report in results if isinstance(report, Exception)]
+        reports = [(url, report) for url, report in results if not isinstance(report, Exception) and report.teams]
+        if not reports:
+            messagebox.showerror("Error", "Page loaded but no team data found. The page may still be loading.")
+            return
+
+        chosen = []
+        for index, (url, report) in enumerate(reports):
+            letters = sorted(report.teams)
+            previous = self.br_team_choices.get(normalize_br_url(url))
+            selected_team = self.show_team_selection_dialog(
+                report.team_data(),
+                subtitle=f"Battle report {index + 1} of {len(reports)}: {url}" if len(reports) > 1 else None,
+                preselect=letters.index(previous) if previous in letters else None,
+            )
+            if selected_team is None:
+                return
+            self.br_team_choices[normalize_br_url(url)] = letters[selected_team]
+            chosen.append(report.teams[letters[selected_team]])
+
+        imported = []
+        with tracer.span('br_import.add_pilots'):
+            for char_id, name, fights in merge_br_attendance(chosen):
+                participant = self.add_participant(Participant(name, character_id=char_id))
+                participant.fights += fights
+                imported.append(participant)
+
+        if len(chosen) > 1 and messagebox.askyesno(
+            "Attendance Shares",
+            f"Pilots were in between {min(p.fights for p in imported)} and {max(p.fights for p in imported)} "
+            f"of the {len(chosen)} fights.\n\nSet each imported pilot's share count to the number of fights they were in?",
+        ):
+            self.seed_shares_from_attendance(imported)
+        else:
             self.refresh_tree()
-            messagebox.showinfo("Success", f"Imported {count} characters!")
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to fetch BR: {str(e)}")
-        finally:
-            self.root.config(cursor="")
+        summary = f"Imported {len(imported)} characters!"
+        if len(results) > 1:
+            summary = f"Imported {len(imported)} characters from {len(chosen)} battle reports!"
+        if failed:
+            summary += "\n\nCould not import:\n" + "\n".join(f"{url}: {error}" for url, error in failed)
+        messagebox.showinfo("Success", summary)
+
+    def seed_shares_from_attendance(self, participants):
+        """Turn on dynamic shares and give each participant one share per fight attended."""
+        if not self.dynamic_shares_enabled:
+            self.default_dynamic_shares = 1
+        for participant in participants:
+            participant.num_shares = max(participant.fights, 1)
+        self.recalculate_shares()
 
-    def show_team_selection_dialog(self, teams):
-        """Show a dialog to select which team to import."""
+    def show_team_selection_dialog(self, teams, subtitle=None, preselect=None):
+        """Show a dialog to select which team to import; preselect is a team index to start on."""
         dialog = tk.Toplevel(self.root)
         dialog.title("Select Team for Payout")
         dialog.transient(self.root)
@@ -538,6 +2877,8 @@ class FCPayoutApp:
         dialog.result = None
 
         tk.Label(dialog, text="Which team is payout for?", font=("Segoe UI", 12, "bold")).pack(pady=10)
+        if subtitle:
+            tk.Label(dialog, text=subtitle, font=("Segoe UI", 9), wraplength=base_width - 40).pack()
 
         info_frame = tk.Frame(dialog)
         info_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
@@ -612,7 +2953,9 @@ class FCPayoutApp:
         dialog.protocol("WM_DELETE_WINDOW", cancel_selection)
         dialog.grab_set()
 
-        if len(teams) == 1:
+        if preselect is not None:
+            on_select(preselect)
+        elif len(teams) == 1:
             on_select(0)
 
         dialog.wait_window()
@@ -621,36 +2964,98 @@ class FCPayoutApp:
     def add_and_lookup_names(self, names):
         if not names:
             self.refresh_tree()
+            self.resolve_affiliations_in_background()
             return
 
-        characters = {}
-        try:
-            response = requests.post(
-                "https://esi.evetech.net/latest/universe/ids/",
-                json=names,
-                timeout=30,
-            )
-            response.raise_for_status()
-            payload = response.json() or {}
-            characters = {item['name']: item['id'] for item in payload.get('characters', [])}
-        except Exception as e:
-            print(f"Error querying ESI: {e}")
-
-        for name in names:
-            self.add_participant(Participant(name, character_id=characters.get(name)))
+        with tracer.span('add_and_lookup_names.add', names=len(names)):
+            for name in names:
+                self.add_participant(Participant(name))
 
+        lookups = [name for name in dict.fromkeys(names) if self.participants.get_by_name(name).character_id is None]
+        self.pending_id_names.update(lookups)
         self.refresh_tree()
+        if lookups:
+            self.resolve_ids_in_background(lookups)
+        else:
+            self.resolve_affiliations_in_background()
 
-    def add_participant(self, participant):
-        for existing_participant in self.participants:
-            if existing_participant.name == participant.name:
-                if existing_participant.character_id is None and participant.character_id is not None:
-                    existing_participant.character_id = participant.character_id
+    def resolve_ids_in_background(self, names):
+        """Look up character ids off the Tk thread and fill them in as each batch returns."""
+        events = queue.Queue()
+
+        def run():
+            try:
+                with tracer.span('esi.lookup', names=len(names)):
+                    self.name_cache.resolve(names, on_batch=lambda batch: events.put(('batch', batch)))
+            except Exception as e:
+                print(f"Error querying ESI: {e}")
+            events.put(('done', None))
+
+        def poll():
+            updated = False
+            while True:
+                try:
+                    kind, batch = events.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'done':
+                    self.pending_id_names.difference_update(names)
+                    print(self.name_cache.summary())
+                    self.refresh_tree()
+                    self.resolve_affiliations_in_background()
+                    return
+                for name, character_id in batch.items():
+                    participant = self.participants.get_by_name(name)
+                    if participant is not None and participant.character_id is None:
+                        self.participants.set_character_id(participant, character_id)
+                    self.pending_id_names.discard(name)
+                updated = True
+            if updated:
+                self.refresh_tree()
+            self.root.after(100, poll)
+
+        threading.Thread(target=run, name="esi-lookup", daemon=True).start()
+        self.root.after(100, poll)
+
+    def resolve_affiliations_in_background(self):
+        """Bulk-fetch corporations and alliances for pilots with known ids, then exclude
+        anyone outside the configured friendly corporations and alliances."""
+        pending = pending_affiliations(self.participants)
+        if not pending:
+            return
+        character_ids = [p.character_id for p in pending]
+        events = queue.Queue()
+
+        def run():
+            affiliations = {}
+            try:
+                with tracer.span('esi.affiliation', characters=len(character_ids)):
+                    affiliations = self.affiliation_cache.resolve(character_ids)
+            except Exception as e:
+                print(f"Error querying ESI affiliations: {e}")
+            events.put(affiliations)
+
+        def poll():
+            try:
+                affiliations = events.get_nowait()
+            except queue.Empty:
+                self.root.after(100, poll)
                 return
-            
-        if self.dynamic_shares_enabled:
+            print(self.affiliation_cache.summary())
+            # Participants may have been removed or re-tagged while the lookup ran
+            current = [p for p in pending_affiliations(self.participants) if p.character_id in affiliations]
+            edits = tag_affiliations(current, affiliations)
+            if not self.apply_edits(edits):
+                self.refresh_tree()
+
+        threading.Thread(target=run, name="esi-affiliation", daemon=True).start()
+        self.root.after(100, poll)
+
+    def add_participant(self, participant):
+        participant, added = self.participants.add(participant)
+        if added and self.dynamic_shares_enabled:
             participant.num_shares = self.default_dynamic_shares
-        self.participants.append(participant)
+        return participant
 
     def toggle_dynamic_shares(self):
         raw = simpledialog.askstring("Dynamic Share Default", "Enter the default number of shares or 'off' to disable dynamic shares.")
@@ -675,61 +3080,51 @@ class FCPayoutApp:
         return self.default_dynamic_shares is not None
 
     def recalculate_shares(self):
-        included_participants = [p for p in self.participants if p.included]
-        scouts = [p for p in included_participants if p.scout]
-        lines = [p for p in included_participants if not p.scout]
-
-        if scouts:
-            scout_pool = self.buyback_isk * 0.5
-            line_pool = self.buyback_isk * 0.5
-        else:
-            scout_pool = 0
-            line_pool = self.buyback_isk
-
-        dynamic = self.dynamic_shares_enabled
-        if dynamic:
-            scout_total = sum(p.num_shares for p in scouts)
-            line_total = sum(p.num_shares for p in lines)
-            scout_share = scout_pool / scout_total if scout_total else 0
-            line_share = line_pool / line_total if line_total else 0
-        else:
-            scout_share = scout_pool / len(scouts) if scouts else 0
-            line_share = line_pool / len(lines) if lines else 0
-
-        for participant in self.participants:
-            if not participant.included:
-                participant.share = 0.0
-                continue
-
-            unit = scout_share if participant.scout else line_share
-            multiplier = participant.num_shares if dynamic else 1
-            participant.share = unit * multiplier
-
+        with tracer.span('recalculate_shares', pilots=len(self.participants)):
+            calculate_shares(self.participants, self.buyback_isk, self.dynamic_shares_enabled, self.payout_rules)
         self.refresh_tree()
 
     def refresh_tree(self):
-        self.participant_tree.delete(*self.participant_tree.get_children())
-        included = [p for p in self.participants if p.included]
-        scouts = [p for p in included if p.scout]
-        lines = [p for p in included if not p.scout]
-
-        dynamic_shares_active = self.dynamic_shares_enabled
-        for p in sorted(self.participants, key=lambda x: x.name.lower()):
-            tag = "excluded" if not p.included else "boldshare"
-            self.participant_tree.insert("", "end", iid=str(id(p)), values=(
-                "Yes" if p.included else "No",
-                "Yes" if p.scout else "No",
-                p.name,
-                "Yes" if p.character_id is not None else "No",
-                p.num_shares if dynamic_shares_active else "NA",
-                f"{p.share:,.2f}"
-            ), tags=(tag,))
-
-        scout_isk = scouts[0].share if scouts else 0
-        line_isk = lines[0].share if lines else 0
-
-        self.count_label.config(text=f"Scouts: {len(scouts)} | Line: {len(lines)} | Total: {len(included)}")
-        self.footer.config(text=f"Buyback ISK: {self.buyback_isk:,.2f} | Scout gets: {scout_isk:,.2f} | Line gets: {line_isk:,.2f}")
+        with tracer.span('refresh_tree', pilots=len(self.participants)):
+            dynamic_shares_active = self.dynamic_shares_enabled
+            scout_count = line_count = 0
+            scout_isk = line_isk = 0
+            rows = []
+            for p in self.participants.sorted():
+                if p.included:
+                    if p.scout:
+                        if not scout_count:
+                            scout_isk = p.share
+                        scout_count += 1
+                    else:
+                        if not line_count:
+                            line_isk = p.share
+                        line_count += 1
+                tag = "excluded" if not p.included else "boldshare"
+                found_id = self._found_id_label(p)
+                rows.append((ParticipantStore.iid(p), (
+                    "Yes" if p.included else "No",
+                    "Yes" if p.scout else "No",
+                    p.name,
+                    found_id,
+                    p.num_shares if dynamic_shares_active else "NA",
+                    f"{p.share:,.2f}"
+                ), (tag,), (not p.included, not p.scout, p.name.lower(), found_id, p.num_shares, p.share)))
+            with tracer.span('refresh_tree.sync', rows=len(rows)):
+                self.tree_view.set_rows(rows)
+
+            self._set_label(self.count_label, f"Scouts: {scout_count} | Line: {line_count} | Total: {scout_count + line_count}")
+            self._set_label(self.footer, f"Buyback ISK: {self.buyback_isk:,.2f} | Scout gets: {scout_isk:,.2f} | Line gets: {line_isk:,.2f}")
+
+    @staticmethod
+    def _set_label(label, text):
+        if label.cget("text") != text:
+            label.config(text=text)
+
+    def _found_id_label(self, participant):
+        if participant.character_id is not None:
+            return "Yes"
+        return "Pending" if participant.name in self.pending_id_names else "No"
 
     def ask_multiline_text(self, title, prompt):
         """Show a dialog with a multiline text box and return the entered text."""
@@ -772,71 +3167,635 @@ class FCPayoutApp:
         return result[0]
 
     def copy_payout_mail(self):
-        self.on_buyback_focus_out()
-        
-        def format_name(participant):
-            if participant.character_id:
-                return f"<url=showinfo:1383//{participant.character_id}>{participant.name}</url>"
-            return participant.name
-
-        included_summary = ", ".join(format_name(p) for p in self.participants if p.included)
-
-        scouts = [p for p in self.participants if p.included and p.scout]
-        lines = [p for p in self.participants if p.included and not p.scout]
-
-        max_line_shares = sum([p.num_shares for p in lines])
-        max_scout_shares = sum([p.num_shares for p in scouts])
-
-        scout_member_lines = ""
-        for p in scouts:
-            scout_member_lines += f"- {format_name(p)}"
-            if len(scouts) == 1:
-                scout_member_lines += " (50% = "
-            else:
-                scout_member_lines += ": "
-            
-            scout_member_lines += f"{p.share:,.2f} ISK"
-            if len(scouts) == 1:
-                scout_member_lines += ")"
-            elif self.dynamic_shares_enabled:
-                scout_member_lines += f"   {p.num_shares}/{max_scout_shares} shares"
+        import pyperclip
 
-            scout_member_lines += "\n"
-
-        if scout_member_lines == "":
-            scout_member_lines = "\n"
-
-
-        line_member_lines = ""
-        for p in lines:
-            line_member_lines += f"- {format_name(p)}: {p.share:,.2f} ISK"
-            if self.dynamic_shares_enabled:
-                line_member_lines += f"   {p.num_shares}/{max_line_shares} shares"
-            line_member_lines += "\n"
+        self.on_buyback_focus_out()
+        mails = build_payout_mails(self.participants, self.buyback_isk, self.dynamic_shares_enabled, rules=self.payout_rules)
+        pyperclip.copy(mails[0])
+        self.record_op()
+        if len(mails) > 1:
+            self.show_mail_series_dialog(mails)
 
+    def show_mail_series_dialog(self, mails):
+        """Step through a payout split over several mails, copying one mail at a time."""
+        import pyperclip
 
-        message = f"""
-SEND TO:
-{included_summary if included_summary else 'None'}
-
-Hey everyone,
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Payout Mails")
+        dialog.geometry("380x170")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+
+        current = [0]
+        status_var = tk.StringVar()
+        tk.Label(
+            dialog, text=f"This payout is split into {len(mails)} mails to stay under EVE's mail limits.",
+            font=("Segoe UI", 10), wraplength=340,
+        ).pack(pady=(14, 6))
+        tk.Label(dialog, textvariable=status_var, font=("Segoe UI", 10, "bold")).pack(pady=4)
+
+        def show_status():
+            status_var.set(f"Mail {current[0] + 1} of {len(mails)} copied to clipboard")
+            last = current[0] + 1 == len(mails)
+            next_button.config(text="Done" if last else "Copy Next Mail")
+
+        def copy_next():
+            if current[0] + 1 == len(mails):
+                dialog.destroy()
+                return
+            current[0] += 1
+            pyperclip.copy(mails[current[0]])
+            show_status()
 
-Thanks for joining the op! Here's the payout for the recent loot buyback.
+        button_frame = tk.Frame(dialog)
+        button_frame.pack(pady=12)
+        next_button = tk.Button(button_frame, width=15, command=copy_next, bg="#66ff66")
+        next_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="Copy Again", width=12, command=lambda: pyperclip.copy(mails[current[0]])).pack(
+            side=tk.LEFT, padx=5
+        )
+        tk.Button(button_frame, text="Close", width=10, command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        show_status()
+        next_button.focus_set()
 
-Buyback Total: {self.buyback_isk:,.2f} ISK
+    def record_op(self):
+        """Save the current op to the ledger; copying the mail again updates the same op."""
+        if self.ledger is None or not len(self.participants):
+            return
+        try:
+            self.ledger_op_id = self.ledger.record_op(
+                self.participants, self.buyback_isk, self.dynamic_shares_enabled, op_id=self.ledger_op_id
+            )
+        except sqlite3.Error as e:
+            print(f"Error recording op in ledger: {e}")
 
-Scout(s):
-{scout_member_lines if scout_member_lines else 'None'}
-Line Members:
-{line_member_lines if line_member_lines else 'None'}
-"""
-        pyperclip.copy(message)
+    def export_ledger(self):
+        if self.ledger is None:
+            messagebox.showerror("Error", "The payout ledger could not be opened.")
+            return
+        period = simpledialog.askstring(
+            "Export Ledger", "Period to export (YYYY-MM or YYYY-MM-DD), or leave blank for everything."
+        )
+        if period is None:
+            return
+        try:
+            start, end = period_bounds(period.strip()) if period.strip() else (None, None)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        path = filedialog.asksaveasfilename(
+            title="Export Ledger", defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+            initialfile=f"payouts-{period.strip() or 'all'}.csv",
+        )
+        if not path:
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            self.ledger.export_csv(out, start, end)
+        messagebox.showinfo("Success", f"Exported ledger to {path}")
+
+
+def _pick_team(report, url, letter):
+    if letter:
+        team = report.teams.get(letter.upper())
+        if team is None:
+            raise ValueError(f"{url} has no Team {letter.upper()} (teams: {', '.join(sorted(report.teams))})")
+        return team
+    if len(report.teams) != 1:
+        raise ValueError(f"{url} has several teams ({', '.join(sorted(report.teams))}); choose one with --team")
+    return next(iter(report.teams.values()))
+
+
+def build_payout(buyback_isk, pastes=(), br_urls=(), teams=None, scouts=(), excluded=(),
+                 dynamic_shares=None, shares=None, tiers=None, rules=DEFAULT_PAYOUT_RULES,
+                 name_cache=None, browser_worker=None, attendance_shares=False, br_cache=None, refresh_br=False,
+                 pilot_filter=None, affiliation_cache=None):
+    """Run the import -> share -> mail pipeline without any widgets.
+
+    teams maps a BR URL to the team letter to pay out (None picks the only team),
+    shares maps pilot names to share counts when dynamic shares are on and
+    tiers maps pilot names to extra payout pools from rules. attendance_shares
+    turns on dynamic shares and gives BR pilots one share per BR they were in.
+    BRs found in br_cache are not fetched again unless refresh_br is set, and
+    pilot_filter (default: default_pilot_filter()) drops NPCs and other pilots.
+    With affiliation_cache, pilots are tagged with their corporation and alliance
+    and those outside the filter's friendly ones are excluded.
+    Returns (participants, mail_text).
+    """
+    participants = ParticipantStore()
+    for raw in pastes:
+        for name, char_id in iter_pilot_paste(raw, pilot_filter):
+            participants.add(Participant(name, character_id=char_id))
+
+    teams = teams or {}
+    chosen = []
+    reports = []
+    if br_urls:
+        reports = fetch_br_reports(
+            br_urls, name_cache.esi if name_cache else None, browser_worker, cache=br_cache, refresh=refresh_br,
+            pilot_filter=pilot_filter,
+        )
+    for url, report in zip(br_urls, reports):
+        if isinstance(report, Exception):
+            raise report
+        chosen.append(_pick_team(report, url, teams.get(url)))
+    br_pilots = []
+    for char_id, name, fights in merge_br_attendance(chosen):
+        participant, _ = participants.add(Participant(name, character_id=char_id))
+        participant.fights += fights
+        br_pilots.append(participant)
+
+    unresolved = [p.name for p in participants if p.character_id is None]
+    if unresolved and name_cache is not None:
+        with tracer.span('esi.lookup', names=len(unresolved)):
+            resolved = name_cache.resolve(unresolved)
+        for name, character_id in resolved.items():
+            participant = participants.get_by_name(name)
+            if participant is not None and participant.character_id is None:
+                participants.set_character_id(participant, character_id)
+
+    pending = pending_affiliations(participants)
+    if pending and affiliation_cache is not None:
+        with tracer.span('esi.affiliation', characters=len(pending)):
+            affiliations = affiliation_cache.resolve(p.character_id for p in pending)
+        apply_participant_edits(tag_affiliations(pending, affiliations, pilot_filter))
+
+    dynamic = dynamic_shares is not None or attendance_shares
+    if dynamic_shares is not None:
+        for participant in participants:
+            participant.num_shares = dynamic_shares
+    if attendance_shares:
+        for participant in br_pilots:
+            participant.num_shares = max(participant.fights, 1)
+
+    edits = [(name, 'scout', True) for name in scouts]
+    edits += [(name, 'included', False) for name in excluded]
+    edits += [(name, 'num_shares', int(count)) for name, count in (shares or {}).items()]
+    edits += [(name, 'tier', tier) for name, tier in (tiers or {}).items()]
+    found = []
+    for name, attribute, value in edits:
+        participant = participants.get_by_name(name)
+        if participant is None:
+            print(f"Warning: {name} is not in the fleet", file=sys.stderr)
+            continue
+        found.append((participant, attribute, value))
+    apply_participant_edits(found)
+
+    with tracer.span('recalculate_shares', pilots=len(participants)):
+        calculate_shares(participants, buyback_isk, dynamic, rules)
+    return participants, format_payout_mail(participants, buyback_isk, dynamic, rules)
+
+
+def _load_op(path):
+    """Read an op file: JSON with buyback, pastes (paths relative to the file), br_urls, teams,
+    scouts, excluded, dynamic_shares, attendance_shares, shares, tiers and pools
+    (role -> percent, e.g. {"scout": 50})."""
+    path = Path(path)
+    op = json.loads(path.read_text(encoding='utf-8'))
+    if 'buyback' not in op:
+        raise ValueError(f"{path.name} has no buyback")
+    return {
+        'buyback_isk': parse_isk(str(op['buyback'])),
+        'pastes': [(path.parent / paste).read_text(encoding='utf-8') for paste in op.get('pastes', [])],
+        'br_urls': op.get('br_urls', []),
+        'teams': op.get('teams', {}),
+        'scouts': op.get('scouts', []),
+        'excluded': op.get('excluded', []),
+        'dynamic_shares': op.get('dynamic_shares'),
+        'attendance_shares': bool(op.get('attendance_shares')),
+        'shares': op.get('shares', {}),
+        'tiers': op.get('tiers', {}),
+        'rules': _load_op_rules(op),
+    }
+
+
+def _load_op_rules(op):
+    if 'pools' not in op:
+        return DEFAULT_PAYOUT_RULES
+    try:
+        return PayoutRules(pools=tuple(op['pools'].items()))
+    except ValueError as e:
+        raise ValueError(f"bad pools: {e}") from None
+
+
+def _mail_paths(path, count):
+    """path itself for a single mail, otherwise path with .1, .2, ... before the suffix."""
+    if count == 1:
+        return [path]
+    return [path.with_name(f"{path.stem}.{number}{path.suffix}") for number in range(1, count + 1)]
+
+
+def run_cli(argv):
+    """Compute payouts headlessly. Returns the process exit code."""
+    parser = argparse.ArgumentParser(
+        prog="FC_Payout_tool.py --cli",
+        description="Compute an FC payout mail without the GUI.",
+    )
+    parser.add_argument("--buyback", help="buyback ISK amount, e.g. 1,500,000,000")
+    parser.add_argument("--paste", action="append", default=[], metavar="FILE",
+                        help="file with pasted pilot data (any format Import from Paste accepts)")
+    parser.add_argument("--br", action="append", default=[], metavar="URL", help="br.evetools.org URL to import")
+    parser.add_argument("--team", help="team letter to pay out for every --br URL")
+    parser.add_argument("--scout", action="append", default=[], metavar="NAME", help="mark a pilot as scout")
+    parser.add_argument("--exclude", action="append", default=[], metavar="NAME", help="exclude a pilot from the payout")
+    parser.add_argument("--dynamic-shares", type=int, metavar="N", help="enable dynamic shares with N shares per pilot")
+    parser.add_argument("--attendance-shares", action="store_true",
+                        help="give each BR pilot one share per --br they appear in")
+    parser.add_argument("--refresh-br", action="store_true", help="fetch BRs again even if they are cached")
+    parser.add_argument("--filters", metavar="FILE",
+                        help=f"JSON pilot filter rules to use on top of the built-in NPC list (default: {PILOT_FILTER_FILE})")
+    parser.add_argument("--scout-percent", type=int, default=50, metavar="PCT",
+                        help="percentage of the buyback paid to scouts when there are any (default 50)")
+    parser.add_argument("--split-mails", action="store_true",
+                        help="split the payout into numbered mails that fit EVE's recipient and length limits")
+    parser.add_argument("--output", metavar="PATH", help="write the mail to PATH (a directory with --ops-dir) instead of stdout")
+    parser.add_argument("--ops-dir", metavar="DIR", help="process every *.json op file in DIR")
+    parser.add_argument("--record", action="store_true", help="record the computed payouts in the ledger")
+    parser.add_argument("--ledger-export", metavar="FILE",
+                        help="write per-pilot ledger totals as CSV ('-' for stdout) and exit")
+    parser.add_argument("--ledger-rows", action="store_true", help="with --ledger-export, write every payout row instead of totals")
+    parser.add_argument("--period", metavar="YYYY-MM[-DD]", help="limit --ledger-export to one month or day")
+    args = parser.parse_args(argv)
+
+    if args.ledger_export:
+        try:
+            start, end = period_bounds(args.period) if args.period else (None, None)
+        except ValueError as e:
+            parser.error(f"--period: {e}")
+        ledger = PayoutLedger()
+        try:
+            if args.ledger_export == '-':
+                ledger.export_csv(sys.stdout, start, end, totals=not args.ledger_rows)
+            else:
+                with open(args.ledger_export, 'w', newline='', encoding='utf-8') as out:
+                    ledger.export_csv(out, start, end, totals=not args.ledger_rows)
+        finally:
+            ledger.close()
+        return 0
+
+    if args.ops_dir:
+        # Each file is loaded inside the op loop, so a broken one only fails its own op
+        ops = [(op_path.stem, op_path) for op_path in sorted(Path(args.ops_dir).glob('*.json'))]
+        out_dir = Path(args.output) if args.output else Path(args.ops_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        if args.buyback is None or not (args.paste or args.br):
+            parser.error("--buyback and at least one --paste or --br are required without --ops-dir")
+        try:
+            rules = PayoutRules(pools=(('scout', args.scout_percent),))
+        except ValueError as e:
+            parser.error(f"--scout-percent: {e}")
+        try:
+            buyback_isk = parse_isk(args.buyback)
+        except ValueError as e:
+            parser.error(f"--buyback: {e}")
+        try:
+            pastes = [Path(paste).read_text(encoding='utf-8') for paste in args.paste]
+        except (OSError, UnicodeDecodeError) as e:
+            parser.error(f"--paste: {e}")
+        ops = [(None, {
+            'buyback_isk': buyback_isk,
+            'pastes': pastes,
+            'br_urls': args.br,
+            'teams': {url: args.team for url in args.br},
+            'scouts': args.scout,
+            'excluded': args.exclude,
+            'dynamic_shares': args.dynamic_shares,
+            'attendance_shares': args.attendance_shares,
+            'shares': {},
+            'rules': rules,
+        })]
+
+    esi = EsiClient()
+    cache_path = ':memory:' if transport.isolated else None
+    try:
+        name_cache = EsiNameCache(cache_path, esi=esi)
+    except (OSError, sqlite3.Error):
+        name_cache = EsiNameCache(':memory:', esi=esi)
+    pilot_filter = None
+    if args.filters:
+        try:
+            pilot_filter = PilotFilter.from_file(args.filters, base=default_pilot_filter())
+        except (OSError, ValueError) as e:
+            parser.error(f"could not load --filters: {e}")
+    try:
+        br_cache = BRCache(cache_path)
+    except (OSError, sqlite3.Error):
+        br_cache = BRCache(':memory:')
+    # Affiliations only change the mail through corporation/alliance rules, so skip the lookup without any
+    affiliation_cache = None
+    if (pilot_filter or default_pilot_filter()).has_affiliation_rules:
+        try:
+            affiliation_cache = EsiAffiliationCache(cache_path, esi=esi)
+        except (OSError, sqlite3.Error):
+            affiliation_cache = EsiAffiliationCache(':memory:', esi=esi)
+    browser_worker = transport.wrap_browser(BrowserWorker())
+    ledger = PayoutLedger() if args.record else None
+    failures = 0
+    try:
+        for op_name, op in ops:
+            try:
+                if isinstance(op, Path):
+                    op = _load_op(op)
+                participants, mail = build_payout(
+                    name_cache=name_cache, browser_worker=browser_worker, br_cache=br_cache, refresh_br=args.refresh_br,
+                    pilot_filter=pilot_filter, affiliation_cache=affiliation_cache, **op
+                )
+            except Exception as e:
+                failures += 1
+                print(f"{op_name or 'payout'}: failed: {e}", file=sys.stderr)
+                continue
+            dynamic = op['dynamic_shares'] is not None or op['attendance_shares']
+            if ledger is not None:
+                ledger.record_op(participants, op['buyback_isk'], dynamic, note=op_name)
+            mails = build_payout_mails(participants, op['buyback_isk'], dynamic, rules=op['rules']) if args.split_mails else [mail]
+            if op_name is not None:
+                targets = _mail_paths(out_dir / f"{op_name}.mail.txt", len(mails))
+                for target, text in zip(targets, mails):
+                    target.write_text(text, encoding='utf-8')
+                print(f"{op_name}: {sum(1 for p in participants if p.included)} pilots paid -> {', '.join(map(str, targets))}")
+            elif args.output:
+                for target, text in zip(_mail_paths(Path(args.output), len(mails)), mails):
+                    target.write_text(text, encoding='utf-8')
+            else:
+                print(f"\n{'=' * 40}\n".join(mails))
+    finally:
+        browser_worker.shutdown()
+        if ledger is not None:
+            ledger.close()
+        br_cache.close()
+        if affiliation_cache is not None:
+            affiliation_cache.close()
+        name_cache.close()
+        esi.close()
+    return 1 if failures else 0
+
+
+BENCHMARK_SIZES = (100, 1000, 10000)
+PASTE_FORMATS = ('tab', 'comma', 'line', 'charid', 'mixed')
+
+
+def _synthetic_pilots(count):
+    return [(str(90000000 + i), f"Synthetic Pilot {i:05d}") for i in range(count)]
+
+
+def synthetic_br_html(count, teams=2):
+    """Return br.evetools.org-shaped HTML with count pilots spread across teams."""
+    pilots = _synthetic_pilots(count)
+    parts = ['<html><body>']
+    for t in range(teams):
+        letter = chr(ord('A') + t)
+        members = pilots[t::teams]
+        parts.append(f'<h4 class="team-header">Team {letter} ({len(members)} pilots)</h4><div class="team">')
+        for i, (char_id, name) in enumerate(members):
+            corp_id = 98000000 + t * 100 + i % 40
+            # Every fifth corp is unaffiliated so both team lookups are exercised
+            ally_id = 99000000 + t * 100 + i % 8 if i % 5 else None
+            parts.append('<div class="pilot">')
+            parts.append(f'<a href="https://zkillboard.com/character/{char_id}/" target="_blank">{name}</a>')
+            parts.append(f'<a href="https://zkillboard.com/corporation/{corp_id}/" target="_blank">Corp {corp_id}</a>')
+            if ally_id:
+                parts.append(f'<a href="https://zkillboard.com/alliance/{ally_id}/" target="_blank">Alliance {ally_id}</a>')
+                parts.append(f'<img class="logo allyID-{ally_id}">')
+            parts.append(f'<img class="logo corpID-{corp_id}"><span class="ship">Muninn</span></div>')
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def synthetic_paste(count, fmt):
+    """Return a pilot paste with count pilots in one of PASTE_FORMATS."""
+    return _format_paste(_synthetic_pilots(count), fmt)
+
+
+def _format_paste(pilots, fmt):
+    if fmt == 'tab':
+        return '\n'.join(f"{name}\tJita\tMuninn\tHeavy Assault Cruiser" for _, name in pilots)
+    if fmt == 'comma':
+        names = [name for _, name in pilots]
+        return '\n'.join(', '.join(names[i:i + 25]) for i in range(0, len(names), 25))
+    if fmt == 'line':
+        return '\n'.join(name for _, name in pilots)
+    if fmt == 'charid':
+        return '\n'.join(f"charID-{char_id}\n{name}" for char_id, name in pilots)
+    if fmt == 'mixed':
+        # One block per format, as when a fleet window, a FAT export and typed names are pasted together
+        return '\n\n'.join(_format_paste(pilots[i::4], block_fmt) for i, block_fmt in enumerate(PASTE_FORMATS[:4]))
+    raise ValueError(f"Unknown paste format {fmt!r}")
+
+
+def _time_call(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'max_ms': round(max(samples), 3),
+    }
+
+
+def _synthetic_store(count):
+    """Roster built the way an op usually is: a paste by name, then a BR that fills in ids."""
+    store = ParticipantStore()
+    pilots = _synthetic_pilots(count)
+    for _, name in pilots:
+        store.add(Participant(name))
+    for char_id, name in pilots:
+        store.add(Participant(name, character_id=char_id))
+    for i, participant in enumerate(store):
+        participant.scout = i % 20 == 0
+        participant.num_shares = 1 + i % 3
+    return store
+
+
+def _benchmark_size(count, repeat, app=None):
+    results = {}
+    html = synthetic_br_html(count)
+    results['br_parse'] = _time_call(lambda: parse_br_html(html), repeat)
+    for fmt in PASTE_FORMATS:
+        raw = synthetic_paste(count, fmt)
+        results[f'paste_{fmt}'] = _time_call(lambda: parse_pilot_paste(raw), repeat)
+
+    results['add_participant'] = _time_call(lambda: _synthetic_store(count), repeat)
+
+    store = _synthetic_store(count)
+    buyback_isk = Decimal('12345678901.23')
+    results['recalculate_shares'] = _time_call(lambda: calculate_shares(store, buyback_isk, True), repeat)
+
+    # copy_payout_mail minus the clipboard, which depends on the desktop rather than this code
+    ledger = PayoutLedger(':memory:')
+    op_id = ledger.record_op(store, buyback_isk, True)
+
+    def copy_mail():
+        format_payout_mail(store, buyback_isk, True)
+        ledger.record_op(store, buyback_isk, True, op_id=op_id)
+    results['copy_payout_mail'] = _time_call(copy_mail, repeat)
+    ledger.close()
+
+    if app is None:
+        results['refresh_tree'] = results['refresh_tree_unchanged'] = {'skipped': 'no Tk display'}
+        return results
+
+    app.default_dynamic_shares = 1
+    app.buyback_isk = buyback_isk
+
+    def empty_tree():
+        app.participants.clear()
+        app.refresh_tree()
+        for participant in store:
+            app.participants.add(participant)
+    results['refresh_tree'] = _time_call(app.refresh_tree, repeat, setup=empty_tree)
+    results['refresh_tree_unchanged'] = _time_call(app.refresh_tree, repeat)
+    app.participants.clear()
+    app.refresh_tree()
+    return results
+
+
+def _benchmark_app():
+    """A withdrawn FCPayoutApp for the Treeview benchmarks, or None without a display."""
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    app = FCPayoutApp(root)
+    if app.ledger is not None:
+        app.ledger.close()
+    app.ledger = None
+    return app
+
+
+def run_benchmark(argv):
+    """Time the parsing, share and display hot paths on synthetic fleets and print JSON."""
+    parser = argparse.ArgumentParser(
+        prog="FC_Payout_tool.py --benchmark",
+        description="Benchmark the hot paths against synthetic fleets and BR pages.",
+    )
+    parser.add_argument("--sizes", default=','.join(map(str, BENCHMARK_SIZES)),
+                        help="comma-separated pilot counts (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (default %(default)s)")
+    parser.add_argument("--output", metavar="FILE", help="also write the JSON results to FILE")
+    parser.add_argument("--no-gui", action="store_true", help="skip the Treeview benchmarks")
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    app = None if args.no_gui else _benchmark_app()
+    try:
+        results = {str(size): _benchmark_size(size, args.repeat, app) for size in sizes}
+    finally:
+        if app is not None:
+            app.on_close()
+
+    report = json.dumps({
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'repeat': args.repeat,
+        'results': results,
+    }, indent=2)
+    if args.output:
+        Path(args.output).write_text(report + '\n', encoding='utf-8')
+    print(report)
+    return 0
+
+
+STARTUP_PROBE_ENV = 'FC_PAYOUT_STARTUP_PROBE'
+
+
+def run_startup_benchmark(argv):
+    """Time launch -> interactive main window over several runs and print the result as JSON."""
+    parser = argparse.ArgumentParser(
+        prog="FC_Payout_tool.py --benchmark-startup",
+        description="Measure how long the GUI takes to become interactive.",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--exe", metavar="PATH", help="executable to time, e.g. a PyInstaller build (default: this program)")
+    args = parser.parse_args(argv)
+
+    if args.exe:
+        command = [args.exe]
+    elif getattr(sys, 'frozen', False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, os.path.abspath(__file__)]
+
+    samples = []
+    failures = []
+    probe_file = APP_DATA_DIR / 'startup_probe.txt'
+    probe_file.parent.mkdir(parents=True, exist_ok=True)
+    for run in range(1, args.runs + 1):
+        probe_file.unlink(missing_ok=True)
+        env = dict(os.environ, **{STARTUP_PROBE_ENV: str(probe_file)})
+        started = time.time()
+        try:
+            result = subprocess.run(command, env=env, timeout=120, check=False)
+            returncode = result.returncode
+        except subprocess.TimeoutExpired:
+            returncode = 'timeout'
+        except OSError as exc:
+            print(f"Could not start {command[0]}: {exc}", file=sys.stderr)
+            return 1
+        try:
+            samples.append((float(probe_file.read_text()) - started) * 1000)
+        except (OSError, ValueError):
+            # No window came up (no display, crash before the main loop, ...)
+            failures.append({'run': run, 'returncode': returncode})
+            print(f"Run {run} never reached the main window (exit status {returncode})", file=sys.stderr)
+    probe_file.unlink(missing_ok=True)
+
+    if not samples:
+        print(json.dumps({'command': command, 'runs': args.runs, 'failed_runs': failures}, indent=2))
+        return 1
+    print(json.dumps({
+        'command': command,
+        'runs': args.runs,
+        'failed_runs': failures,
+        'samples_ms': [round(sample, 1) for sample in samples],
+        'min_ms': round(min(samples), 1),
+        'median_ms': round(statistics.median(samples), 1),
+        'max_ms': round(max(samples), 1),
+    }, indent=2))
+    return 0
+
+
+def _write_startup_probe(root, path):
+    # Runs once the event loop is idle, i.e. the window is drawn and accepting input
+    Path(path).write_text(repr(time.time()))
+    root.destroy()
 
 
 if __name__ == "__main__":
+    if '--trace' in sys.argv:
+        trace_index = sys.argv.index('--trace')
+        if trace_index + 1 >= len(sys.argv):
+            sys.exit("--trace needs a file to write the trace to")
+        tracer.enable(sys.argv[trace_index + 1])
+        del sys.argv[trace_index:trace_index + 2]
+    for flag in ('--transport', '--latency'):
+        if flag in sys.argv:
+            flag_index = sys.argv.index(flag)
+            if flag_index + 1 >= len(sys.argv):
+                sys.exit(f"{flag} needs a value")
+            try:
+                if flag == '--transport':
+                    transport.configure(sys.argv[flag_index + 1])
+                else:
+                    transport.configure(latency_ms=sys.argv[flag_index + 1])
+            except (OSError, ValueError) as e:
+                sys.exit(f"{flag}: {e}")
+            del sys.argv[flag_index:flag_index + 2]
+    if '--cli' in sys.argv:
+        sys.exit(run_cli([arg for arg in sys.argv[1:] if arg != '--cli']))
+    if '--benchmark' in sys.argv:
+        sys.exit(run_benchmark([arg for arg in sys.argv[1:] if arg != '--benchmark']))
+    if '--benchmark-startup' in sys.argv:
+        sys.exit(run_startup_benchmark([arg for arg in sys.argv[1:] if arg != '--benchmark-startup']))
     root = tk.Tk()
-    root.withdraw()
-    ensure_playwright_ready(root)
-    root.deiconify()
     app = FCPayoutApp(root)
+    if os.environ.get(STARTUP_PROBE_ENV):
+        root.after_idle(_write_startup_probe, root, os.environ[STARTUP_PROBE_ENV])
     root.mainloop()
@@ -0,0 +1,50 @@
+// Runs BR_SCAN_SCRIPT outside a browser. Reads a parsed page tree as JSON
+// on stdin ({tag, attrs: [[name, value]], children: [node | text]}), exposes
+// the bits of the DOM the script uses and prints the scan as JSON.
+const fs = require('fs');
+
+function build(node) {
+    const el = {
+        tagName: node.tag.toUpperCase(),
+        attributes: node.attrs.map(([name, value]) => ({name, value: value === null ? '' : value})),
+        children: node.children.map(child => (typeof child === 'string' ? child : build(child))),
+        getAttribute(name) {
+            const attr = this.attributes.find(a => a.name === name);
+            return attr ? attr.value : null;
+        },
+        get textContent() {
+            return this.children.map(child => (typeof child === 'string' ? child : child.textContent)).join('');
+        },
+    };
+    return el;
+}
+
+function elements(el, out) {
+    out.push(el);
+    for (const child of el.children) {
+        if (typeof child !== 'string') elements(child, out);
+    }
+    return out;
+}
+
+const root = build(JSON.parse(fs.readFileSync(0, 'utf8')));
+const body = elements(root, []).find(el => el.tagName === 'BODY') || root;
+global.NodeFilter = {SHOW_ELEMENT: 1};
+global.document = {
+    body,
+    createTreeWalker(start) {
+        const order = elements(start, []);
+        let index = 0;
+        return {
+            currentNode: order[0],
+            nextNode() {
+                index += 1;
+                this.currentNode = order[index] || null;
+                return this.currentNode;
+            },
+        };
+    },
+};
+
+const script = fs.readFileSync(process.argv[2], 'utf8');
+process.stdout.write(JSON.stringify(eval(script)()));
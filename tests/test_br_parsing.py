@@ -0,0 +1,121 @@
+import json
+import shutil
+import subprocess
+from html.parser import HTMLParser
+from pathlib import Path
+
+import pytest
+
+import FC_Payout_tool as fc
+
+DOM_SHIM = Path(__file__).resolve().parent / 'dom_shim.js'
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr'}
+
+
+def team_names(report):
+    return {letter: [char['name'] for char in team.characters] for letter, team in report.teams.items()}
+
+
+def test_two_team_fixture(fixture_text):
+    report = fc.parse_br_html(fixture_text('br_two_teams.html'))
+
+    assert team_names(report) == {
+        'A': ['Alice Alpha', 'Bob Bravo', 'Carol Charlie'],
+        'B': ['Dave Delta', 'Eve Echo'],
+    }
+    assert report.teams['A'].alliances == {'99001001'}
+    assert report.teams['A'].corporations == {'98001001', '98001002'}
+    assert report.alliance_names == {'99001001': 'Alpha Alliance', '99002001': 'Bravo Coalition'}
+    assert report.corporation_names['98002002'] == 'Echo Salvage'
+
+
+def test_corp_only_pilot_is_placed_by_corporation(fixture_text):
+    scan = fc.scan_br_html(fixture_text('br_two_teams.html'))
+
+    assert ['1002', 'Bob Bravo', None, '98001002'] in scan['pilots']
+    assert scan['corpTeam']['98001002'] == 'A'
+
+
+def test_npc_rows_are_dropped(fixture_text):
+    html = fixture_text('br_two_teams.html')
+    names = {char['name'] for team in fc.parse_br_html(html).teams.values() for char in team.characters}
+
+    # Dropped by name and, for the unnamed NPC, by its corporation
+    assert 'Hyleus Tyrannos' not in names
+    assert 'Drifter Response' not in names
+    everyone = fc.parse_br_html(html, fc.PilotFilter())
+    assert [char['name'] for char in everyone.teams['A'].characters][-2:] == ['Hyleus Tyrannos', 'Drifter Response']
+
+
+@pytest.mark.parametrize('link', [
+    '<a href="/character/1/" class="allyID-5">X</a>',
+    '<a class="allyID-5" href="/character/1/">X</a>',
+])
+def test_markers_inside_the_link_tag(link):
+    report = fc.parse_br_html(f'<h4>Team A</h4>{link}')
+
+    assert team_names(report) == {'A': ['X']}
+    assert report.teams['A'].alliances == {'5'}
+
+
+def test_markers_in_a_link_belong_to_that_link_not_the_previous_pilot():
+    html = (
+        '<h4>Team A</h4><img class="allyID-5"><img class="corpID-7">'
+        '<a href="/character/1/">One</a><img class="corpID-7">'
+        '<a class="corpID-8" href="/character/2/">Two</a>'
+        '<h4>Team B</h4><img class="corpID-8">'
+    )
+    scan = fc.scan_br_html(html)
+
+    assert scan['pilots'] == [['1', 'One', None, '7'], ['2', 'Two', None, '8']]
+    assert team_names(fc.build_br_report(scan)) == {'A': ['One', 'Two']}
+
+
+class _TreeBuilder(HTMLParser):
+    """Parses a page into the JSON tree dom_shim.js expects."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = {'tag': 'document', 'attrs': [], 'children': []}
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        node = {'tag': tag, 'attrs': [list(attr) for attr in attrs], 'children': []}
+        self.stack[-1]['children'].append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_endtag(self, tag):
+        for depth in range(len(self.stack) - 1, 0, -1):
+            if self.stack[depth]['tag'] == tag:
+                del self.stack[depth:]
+                return
+
+    def handle_data(self, data):
+        self.stack[-1]['children'].append(data)
+
+
+def run_scan_script(html, tmp_path):
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    script = tmp_path / 'scan.js'
+    script.write_text(fc.BR_SCAN_SCRIPT, encoding='utf-8')
+    result = subprocess.run(
+        ['node', str(DOM_SHIM), str(script)],
+        input=json.dumps(builder.root), capture_output=True, text=True, check=True, timeout=60,
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason="needs node to run BR_SCAN_SCRIPT")
+@pytest.mark.parametrize('html', [
+    pytest.param('fixture:br_two_teams.html', id='two-teams'),
+    pytest.param(fc.synthetic_br_html(60, teams=3), id='synthetic'),
+    pytest.param('<h4>Team A</h4><a class="corpID-7 allyID-5" href="/character/1/">X</a>', id='markers-in-link'),
+])
+def test_scan_script_matches_scan_br_html(html, fixture_text, tmp_path):
+    if html.startswith('fixture:'):
+        html = fixture_text(html.split(':', 1)[1])
+
+    assert run_scan_script(html, tmp_path) == fc.scan_br_html(html)
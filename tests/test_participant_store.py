@@ -0,0 +1,111 @@
+import time
+
+import FC_Payout_tool as fc
+
+
+def pilots(count, start=0, id_offset=0, upper=False):
+    """count pilots with character ids; upper gives the same pilots with their names in upper case."""
+    return [
+        fc.Participant(f"Pilot {i:05d}".upper() if upper else f"Pilot {i:05d}", character_id=str(90000000 + id_offset + i))
+        for i in range(start, start + count)
+    ]
+
+
+def test_lookup_by_name_iid_and_character_id():
+    store = fc.ParticipantStore()
+    alice, added = store.add(fc.Participant("Alice Alpha", character_id="1001"))
+
+    assert added
+    assert store.get_by_name("  alice ALPHA ") is alice
+    assert store.get_by_iid(alice.iid) is alice
+    assert store.get_by_character_id(1001) is alice
+    assert store.get_by_name("Bob") is None
+    assert store.get_by_character_id("9") is None
+
+
+def test_merge_by_name_fills_in_character_id():
+    store = fc.ParticipantStore()
+    bob, _ = store.add(fc.Participant("Bob Bravo"))
+    merged, added = store.add(fc.Participant("BOB BRAVO", character_id="1002"))
+
+    assert merged is bob and not added
+    assert bob.character_id == "1002"
+    assert store.get_by_character_id("1002") is bob
+    assert len(store) == 1
+
+
+def test_merge_by_character_id_keeps_the_first_entry():
+    store = fc.ParticipantStore()
+    first, _ = store.add(fc.Participant("Carol Charlie", character_id="1003"))
+    merged, added = store.add(fc.Participant("Carol Renamed", character_id="1003"))
+
+    assert merged is first and not added
+    assert [p.name for p in store] == ["Carol Charlie"]
+
+
+def test_iids_are_never_reused():
+    store = fc.ParticipantStore()
+    old = {store.add(p)[0].iid for p in pilots(50)}
+    store.clear()
+    new = {store.add(p)[0].iid for p in pilots(50, start=50)}
+
+    assert not old & new
+    assert all(store.get_by_iid(iid) is None for iid in old)
+
+
+def test_remove_iids_drops_every_index():
+    store = fc.ParticipantStore()
+    dave, _ = store.add(fc.Participant("Dave Delta", character_id="2001"))
+    eve, _ = store.add(fc.Participant("Eve Echo", character_id="2002"))
+    store.remove_iids([dave.iid, "unknown"])
+
+    assert list(store) == [eve]
+    assert store.get_by_name("Dave Delta") is None
+    assert store.get_by_character_id("2001") is None
+    # The pilot can be added again afterwards
+    assert store.add(fc.Participant("Dave Delta", character_id="2001"))[1]
+
+
+def test_sorted_is_case_insensitive_and_follows_membership():
+    store = fc.ParticipantStore()
+    for name in ("charlie", "Bravo", "alpha"):
+        store.add(fc.Participant(name))
+    assert [p.name for p in store.sorted()] == ["alpha", "Bravo", "charlie"]
+
+    store.add(fc.Participant("Able"))
+    assert [p.name for p in store.sorted()] == ["Able", "alpha", "Bravo", "charlie"]
+
+
+def test_merging_several_5k_imports():
+    # The second import is the same fleet with different name casing and the
+    # third overlaps half of it, so every path through add() is taken
+    imports = [pilots(5000), pilots(5000, upper=True), pilots(5000, start=2500)]
+    store = fc.ParticipantStore()
+    for batch in imports:
+        for participant in batch:
+            store.add(participant)
+
+    assert len(store) == 7500
+    assert store.get_by_name("pilot 07499").character_id == "90007499"
+
+
+def best_time(build, runs=5):
+    best = None
+    for _ in range(runs):
+        batches = build()
+        started = time.perf_counter()
+        store = fc.ParticipantStore()
+        for batch in batches:
+            for participant in batch:
+                store.add(participant)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_merging_scales_linearly():
+    one = best_time(lambda: [pilots(5000)])
+    three = best_time(lambda: [pilots(5000), pilots(5000, upper=True), pilots(5000, start=5000)])
+
+    # Linear merging costs about 3x; anything that rescans the store grows far faster
+    assert three < one * 6
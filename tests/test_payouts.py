@@ -0,0 +1,117 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+import FC_Payout_tool as fc
+
+LOGI_RULES = fc.PayoutRules(pools=(('scout', 20), ('logi', 30)))
+
+
+def fleet(count, scouts=0, logi=0, excluded=0, seed=0):
+    rng = random.Random(seed)
+    store = fc.ParticipantStore()
+    for i in range(count):
+        participant, _ = store.add(fc.Participant(
+            f"Pilot {i:04d}", character_id=str(90000000 + i) if i % 4 else None, num_shares=rng.randint(1, 5),
+        ))
+        participant.scout = i < scouts
+        participant.tier = 'logi' if scouts <= i < scouts + logi else None
+        # The last `excluded` pilots are left out of the payout
+        participant.included = i < count - excluded
+    return store
+
+
+def paid(store):
+    return sum(p.share for p in store)
+
+
+@pytest.mark.parametrize('dynamic', [False, True])
+@pytest.mark.parametrize('buyback', ['0.01', '100.00', '1000000.01', '1234567890.99'])
+@pytest.mark.parametrize('scouts,logi', [(0, 0), (1, 0), (3, 0), (2, 4)])
+def test_payouts_sum_exactly_to_the_buyback(dynamic, buyback, scouts, logi):
+    store = fleet(37, scouts=scouts, logi=logi, excluded=5, seed=len(buyback))
+    fc.calculate_shares(store, Decimal(buyback), dynamic, LOGI_RULES)
+
+    assert paid(store) == Decimal(buyback)
+    assert all(p.share == 0 for p in store if not p.included)
+    assert all(p.share >= 0 for p in store)
+
+
+def test_scout_pool_and_line_pool():
+    store = fleet(5, scouts=1)
+    fc.calculate_shares(store, Decimal(1000), False)
+
+    assert [p.share for p in store] == [Decimal('500.00')] + [Decimal('125.00')] * 4
+
+
+@pytest.mark.parametrize('percent', [0, 30, 100])
+def test_scouts_only_fleet_gets_the_whole_buyback(percent):
+    store = fleet(3, scouts=3)
+    fc.calculate_shares(store, Decimal(100), False, fc.PayoutRules(pools=(('scout', percent),)))
+
+    assert paid(store) == Decimal(100)
+    assert sorted(p.share for p in store) == [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')]
+
+
+def test_empty_remainder_splits_by_pool_percentages():
+    store = fleet(3, scouts=1, logi=2)
+    fc.calculate_shares(store, Decimal(1000), False, LOGI_RULES)
+
+    # 20% : 30% of everything, since nobody is in the line pool
+    assert [p.share for p in store] == [Decimal('400.00'), Decimal('300.00'), Decimal('300.00')]
+
+
+def test_tier_pools_are_shared_within_the_pool():
+    store = fleet(5, scouts=1, logi=1)
+    fc.calculate_shares(store, Decimal(1000), False, LOGI_RULES)
+
+    assert [p.share for p in store] == [Decimal('200.00'), Decimal('300.00')] + [Decimal('166.67'), Decimal('166.67'), Decimal('166.66')]
+
+
+def test_nobody_included_pays_nothing():
+    store = fleet(4, excluded=4)
+    fc.calculate_shares(store, Decimal(1000), False)
+
+    assert paid(store) == 0
+
+
+@pytest.mark.parametrize('pools', [
+    (('scout', 101),), (('scout', -1),), (('scout', 60), ('logi', 50)), (('scout', 12.5),),
+])
+def test_pool_percentages_are_validated(pools):
+    with pytest.raises(ValueError):
+        fc.PayoutRules(pools=pools)
+
+
+def mail_recipients(mail):
+    lines = mail.strip().splitlines()
+    return lines[lines.index('SEND TO:') + 1].split(', ')
+
+
+@pytest.mark.parametrize('max_recipients,max_chars', [(50, 8000), (7, 8000), (50, 1500)])
+def test_split_mails_cover_every_pilot_once_within_limits(max_recipients, max_chars):
+    store = fleet(120, scouts=3, logi=6, excluded=10, seed=7)
+    fc.calculate_shares(store, Decimal('987654321.12'), True, LOGI_RULES)
+
+    mails = fc.build_payout_mails(store, Decimal('987654321.12'), True, max_recipients, max_chars, rules=LOGI_RULES)
+
+    assert len(mails) > 1
+    recipients = [name for mail in mails for name in mail_recipients(mail)]
+    expected = [fc._mail_recipient(p) for p in store if p.included]
+    assert sorted(recipients) == sorted(expected)
+    for number, mail in enumerate(mails, 1):
+        assert len(mail_recipients(mail)) <= max_recipients
+        assert len(mail) <= max_chars
+        assert f"Payout mail {number} of {len(mails)}" in mail
+    # Every included pilot's payout row appears in exactly one mail
+    for p in store:
+        rows = sum(mail.count(f"- {fc._mail_recipient(p)}:") + mail.count(f"- {fc._mail_recipient(p)} (") for mail in mails)
+        assert rows == (1 if p.included else 0)
+
+
+def test_small_payout_is_one_mail():
+    store = fleet(10, scouts=1)
+    fc.calculate_shares(store, Decimal(1000), False)
+
+    assert fc.build_payout_mails(store, Decimal(1000), False) == [fc.format_payout_mail(store, Decimal(1000), False)]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import FC_Payout_tool as fc
+
+
+def write_rules(tmp_path, rules):
+    path = tmp_path / 'pilot_filters.json'
+    path.write_text(json.dumps(rules), encoding='utf-8')
+    return path
+
+
+def test_rules_are_added_to_the_base(tmp_path):
+    path = write_rules(tmp_path, {'names': ['Some Alt'], 'name_patterns': ['^Cyno '], 'corporation_ids': [98000001, '98000002']})
+    pilot_filter = fc.PilotFilter.from_file(path, base=fc.PilotFilter(names=['Hyleus Tyrannos']))
+
+    assert pilot_filter.excludes_name('some alt')
+    assert pilot_filter.excludes_name('Hyleus Tyrannos')
+    assert pilot_filter.excludes_name('cyno alt 3')
+    assert pilot_filter.excludes('Anyone', corporation_id=98000002)
+    assert not pilot_filter.excludes('B')
+
+
+@pytest.mark.parametrize('rules', [
+    ['Some Alt'],
+    {'names': 'Bob'},
+    {'names': [7]},
+    {'corporation_ids': [True]},
+    {'alliance_ids': 99000001},
+    {'name_patterns': ['(']},
+])
+def test_malformed_rules_raise_value_error(tmp_path, rules):
+    with pytest.raises(ValueError):
+        fc.PilotFilter.from_file(write_rules(tmp_path, rules))
+
+
+def test_default_filter_ignores_a_malformed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(fc, 'PILOT_FILTER_FILE', write_rules(tmp_path, ['Some Alt']))
+    monkeypatch.setattr(fc, '_default_pilot_filter', None)
+
+    pilot_filter = fc.default_pilot_filter()
+
+    assert pilot_filter.excludes_name('Hyleus Tyrannos')
+    assert not pilot_filter.excludes_name('Some Alt')
+
+
+def test_tagged_pilots_are_checked_against_affiliation_rules():
+    npc = fc.Participant('Npc Pilot', character_id='1')
+    friend = fc.Participant('Friend', character_id='2')
+    foe = fc.Participant('Foe', character_id='3')
+    untagged = fc.Participant('Unknown', character_id='4')
+    affiliations = {'1': ('1000274', None), '2': ('500', '99'), '3': ('600', '77')}
+    pilot_filter = fc.PilotFilter(corporation_ids=['1000274'], friendly_alliance_ids=[99])
+
+    edits = fc.tag_affiliations([npc, friend, foe, untagged], affiliations, pilot_filter)
+
+    assert [(p.name, attribute, value) for p, attribute, value in edits] == [
+        ('Npc Pilot', 'included', False), ('Foe', 'included', False),
+    ]
+    assert (friend.corporation_id, friend.alliance_id) == ('500', '99')
+    assert untagged.corporation_id is None